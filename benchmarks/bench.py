@@ -0,0 +1,354 @@
+"""
+Benchmarks of lib7zip against synthetic archives generated on the fly.
+
+    python benchmarks/bench.py                          # small corpus, print results
+    python benchmarks/bench.py --save baseline.json     # store them as a baseline
+    python benchmarks/bench.py --compare baseline.json  # fail if anything got slower than the baseline
+    python benchmarks/bench.py --scale full             # 1M tiny files, GB sized members
+
+Corpora (zip, tar.gz, tar.bz2, tar.xz and, if a 7z binary is on the PATH, solid 7z) are written with the
+standard library into --corpus-dir and reused by later runs with the same scale and seed.
+Every measurement runs in a fresh interpreter so peak RSS is per operation, and zip/tar archives are
+measured with zipfile/tarfile too as a reference. Note that 7-Zip opens a compressed tar as a single
+member (the .tar inside the gz/bz2/xz stream), so for those the lib7zip column is the cost of the outer layer.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+from time import perf_counter
+import zipfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# measure the lib7zip of this checkout, in this process and in the children running measurements
+sys.path.insert(0, os.path.dirname(HERE))
+
+SCALES = {
+    # shape parameters: number of tiny files, huge files and their size, depth and fan-out of the deep tree
+    'small': {'tiny_files': 10000, 'huge_files': 2, 'huge_size': 16 << 20, 'depth': 12, 'fanout': 3},
+    'full': {'tiny_files': 1000000, 'huge_files': 3, 'huge_size': 1 << 30, 'depth': 64, 'fanout': 4},
+}
+SHAPES = ('tiny', 'huge', 'deep')
+FORMATS = ('zip', 'tar.gz', 'tar.bz2', 'tar.xz', '7z')
+OPS = ('open', 'list', 'list_items', 'extract', 'contents')
+#: items read one by one by the 'contents' op
+CONTENTS_SAMPLE = 200
+SEVENZIP_BINARIES = ('7zz', '7z', '7za')
+
+BLOCK = 1 << 20
+WORDS = b'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt'.split()
+
+
+def block_data(rng: random.Random, size: int) -> bytes:
+    """size bytes of half text, half random data, so every format has something to compress"""
+    text = b' '.join(rng.choice(WORDS) for _ in range(size // 12 + 1))[:size // 2]
+    return text + rng.randbytes(size - len(text))
+
+
+def corpus_entries(shape: str, params: dict, seed: int):
+    """(path, size, chunks) for every file of the shape, chunks is a function generating its contents"""
+    rng = random.Random('{}:{}'.format(shape, seed))
+    if shape == 'tiny':
+        for i in range(params['tiny_files']):
+            size = rng.randrange(0, 256)
+            path = 'tiny/{:04d}/{:07d}.txt'.format(i // 1000, i)
+            data = block_data(rng, size)
+            yield path, size, lambda data=data: iter((data,))
+    elif shape == 'huge':
+        for i in range(params['huge_files']):
+            size = params['huge_size']
+            file_seed = rng.random()
+
+            def chunks(size=size, file_seed=file_seed):
+                file_rng = random.Random(file_seed)
+                for offset in range(0, size, BLOCK):
+                    yield block_data(file_rng, min(BLOCK, size - offset))
+            yield 'huge/{}.bin'.format(i), size, chunks
+    elif shape == 'deep':
+        paths = ['deep']
+        for _ in range(params['depth']):
+            parent = paths[-1]
+            paths.append('{}/d{}'.format(parent, rng.randrange(params['fanout'])))
+            for j in range(params['fanout']):
+                size = rng.randrange(0, 4096)
+                data = block_data(rng, size)
+                yield '{}/f{}.txt'.format(parent, j), size, lambda data=data: iter((data,))
+    else:
+        raise ValueError(shape)
+
+
+class ChunkReader(io.RawIOBase):
+    """file-like object over a chunk generator, for tarfile.addfile"""
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.pending:
+            self.pending = next(self.chunks, b'')
+            if not self.pending:
+                return 0
+        size = min(len(b), len(self.pending))
+        b[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+def find_7z():
+    for name in SEVENZIP_BINARIES:
+        path = shutil.which(name)
+        if path:
+            return path
+    return None
+
+
+def write_archive(path: str, fmt: str, entries):
+    tmp_path = path + '.tmp'
+    if fmt == 'zip':
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name, size, chunks in entries:
+                with zf.open(name, 'w', force_zip64=size > (1 << 31)) as f:
+                    for chunk in chunks():
+                        f.write(chunk)
+    elif fmt.startswith('tar.'):
+        mode = {'tar.gz': 'w:gz', 'tar.bz2': 'w:bz2', 'tar.xz': 'w:xz'}[fmt]
+        with tarfile.open(tmp_path, mode) as tf:
+            for name, size, chunks in entries:
+                info = tarfile.TarInfo(name)
+                info.size = size
+                info.mtime = 1500000000
+                tf.addfile(info, io.BufferedReader(ChunkReader(chunks())))
+    elif fmt == '7z':
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(path)) as tree:
+            for name, size, chunks in entries:
+                file_path = os.path.join(tree, name)
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                with open(file_path, 'wb') as f:
+                    for chunk in chunks():
+                        f.write(chunk)
+            top = os.listdir(tree)
+            subprocess.run([find_7z(), 'a', '-ms=on', '-bd', '-y', os.path.abspath(tmp_path)] + top,
+                           cwd=tree, check=True, stdout=subprocess.DEVNULL)
+    else:
+        raise ValueError(fmt)
+    os.replace(tmp_path, path)
+
+
+def build_corpus(corpus_dir: str, scale: str, seed: int, shapes, formats) -> list:
+    """paths of the archives to measure, generating the ones missing from corpus_dir"""
+    os.makedirs(corpus_dir, exist_ok=True)
+    archives = []
+    for shape in shapes:
+        for fmt in formats:
+            if fmt == '7z' and find_7z() is None:
+                print('no 7z binary found, skipping 7z corpora', file=sys.stderr)
+                continue
+            path = os.path.join(corpus_dir, '{}-{}-{}.{}'.format(shape, scale, seed, fmt))
+            if not os.path.exists(path):
+                print('generating', path, file=sys.stderr)
+                start = perf_counter()
+                write_archive(path, fmt, corpus_entries(shape, SCALES[scale], seed))
+                print('  {:.1f}s, {} bytes'.format(perf_counter() - start, os.path.getsize(path)), file=sys.stderr)
+            archives.append((shape, fmt, path))
+    return archives
+
+
+# measured operations, run in a child process by measure()
+
+def lib7zip_op(op: str, path: str, scratch: str):
+    from lib7zip import Archive, load_tables
+
+    # the format tables are loaded once per process, not part of any operation
+    load_tables()
+
+    if op == 'open':
+        return lambda: Archive(path).close()
+
+    # no member cache, or every run after the first would only time cache hits
+    archive = Archive(path, cache_size=0)
+    if op == 'list':
+        return lambda: archive.metadata()
+    elif op == 'list_items':
+        return lambda: [(item.path, item.size) for item in archive]
+    elif op == 'extract':
+        return lambda: archive.extract(tempfile.mkdtemp(dir=scratch))
+    elif op == 'contents':
+        is_dir = archive.metadata(('is_dir',))['is_dir']
+        indices = [index for index, flag in enumerate(is_dir) if flag != 1][:CONTENTS_SAMPLE]
+        return lambda: [archive[index].contents for index in indices]
+    raise ValueError(op)
+
+
+def stdlib_op(op: str, path: str, scratch: str):
+    if path.endswith('.zip'):
+        opener = zipfile.ZipFile
+        listing = lambda archive: [(info.filename, info.file_size) for info in archive.infolist()]
+        read = lambda archive, name: archive.read(name)
+        files = lambda archive: [info.filename for info in archive.infolist() if not info.is_dir()]
+    else:
+        opener = tarfile.open
+        listing = lambda archive: [(info.name, info.size) for info in archive.getmembers()]
+        read = lambda archive, name: archive.extractfile(name).read()
+        files = lambda archive: [info.name for info in archive.getmembers() if info.isfile()]
+
+    if op == 'open':
+        # zipfile reads the central directory, tarfile only the first header
+        return lambda: opener(path).close()
+    elif op in ('list', 'list_items'):
+        # tarfile caches members once read, open the archive anew every time
+        def run():
+            with opener(path) as archive:
+                return listing(archive)
+        return run
+    elif op == 'extract':
+        def run():
+            with opener(path) as archive:
+                archive.extractall(tempfile.mkdtemp(dir=scratch))
+        return run
+    elif op == 'contents':
+        def run():
+            with opener(path) as archive:
+                return [read(archive, name) for name in files(archive)[:CONTENTS_SAMPLE]]
+        return run
+    raise ValueError(op)
+
+
+IMPLS = {'lib7zip': lib7zip_op, 'stdlib': stdlib_op}
+
+
+def peak_rss() -> int:
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def run_measurement(impl: str, op: str, path: str, repeat: int) -> dict:
+    with tempfile.TemporaryDirectory() as scratch:
+        fn = IMPLS[impl](op, path, scratch)
+        times = []
+        for _ in range(repeat):
+            start = perf_counter()
+            fn()
+            times.append(perf_counter() - start)
+        return {'min': min(times), 'median': statistics.median(times), 'peak_rss': peak_rss()}
+
+
+def measure(impl: str, op: str, path: str, repeat: int) -> dict:
+    """run one measurement in a fresh interpreter"""
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--measure', impl, op, path, '--repeat', str(repeat)],
+        check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(out)
+
+
+def run_all(archives, ops, repeat: int, reference: bool) -> dict:
+    results = {}
+    for shape, fmt, path in archives:
+        impls = ['lib7zip'] + (['stdlib'] if reference and fmt != '7z' else [])
+        for op in ops:
+            for impl in impls:
+                key = '{}/{}/{}/{}'.format(shape, fmt, op, impl)
+                try:
+                    results[key] = measure(impl, op, path, repeat)
+                except subprocess.CalledProcessError as ex:
+                    print('{} failed: {}'.format(key, ex), file=sys.stderr)
+                    continue
+                print_row(key, results[key])
+    return results
+
+
+def print_row(key: str, result: dict, baseline: dict=None):
+    rss = result['peak_rss']
+    row = '{:<40} {:>10.4f}s {:>10.4f}s {:>8}'.format(
+        key, result['min'], result['median'], '-' if rss is None else '{}M'.format(rss >> 20))
+    if baseline is not None:
+        row += ' {:>+7.1%}'.format(result['min'] / baseline['min'] - 1 if baseline['min'] else 0)
+    print(row, flush=True)
+
+
+def environment() -> dict:
+    import lib7zip
+    lib7zip.load_dll()
+    return {
+        'python': sys.version,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'dll_path': lib7zip.dll_path,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """keys of the measurements that got slower than baseline by more than threshold"""
+    print('\n{:<40} {:>11} {:>11} {:>8} {:>8}'.format('vs baseline', 'min', 'median', 'rss', 'change'))
+    regressions = []
+    for key, result in results.items():
+        old = baseline['results'].get(key)
+        if old is None:
+            continue
+        print_row(key, result, old)
+        if old['min'] and result['min'] > old['min'] * (1 + threshold):
+            regressions.append(key)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--corpus-dir', default=os.path.join(HERE, 'corpus'))
+    parser.add_argument('--shapes', default=','.join(SHAPES))
+    parser.add_argument('--formats', default=','.join(FORMATS))
+    parser.add_argument('--ops', default=','.join(OPS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-reference', dest='reference', action='store_false',
+                        help="don't measure zipfile/tarfile")
+    parser.add_argument('--save', metavar='JSON', help='store the results as a baseline')
+    parser.add_argument('--compare', metavar='JSON', help='compare the results against a stored baseline')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown relative to the baseline counted as a regression (default 0.1 = 10%%)')
+    parser.add_argument('--measure', nargs=3, metavar=('IMPL', 'OP', 'ARCHIVE'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        impl, op, path = args.measure
+        json.dump(run_measurement(impl, op, path, args.repeat), sys.stdout)
+        return 0
+
+    archives = build_corpus(args.corpus_dir, args.scale, args.seed, args.shapes.split(','), args.formats.split(','))
+    print('{:<40} {:>11} {:>11} {:>8}'.format('shape/format/op/impl', 'min', 'median', 'rss'))
+    results = run_all(archives, args.ops.split(','), args.repeat, args.reference)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'scale': args.scale, 'seed': args.seed, 'environment': environment(), 'results': results},
+                      f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if (baseline['scale'], baseline['seed']) != (args.scale, args.seed):
+            parser.error('baseline was recorded with --scale {} --seed {}'.format(baseline['scale'], baseline['seed']))
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('\nslower than baseline: ' + ', '.join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
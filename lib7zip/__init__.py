@@ -8,8 +8,13 @@ __version__ = '0.1'
 
 from collections import namedtuple
 from functools import partial
+import hashlib
+import json
 import os.path
 import sys
+import threading
+from typing import Optional
+import uuid
 
 import logging
 import ctypes
@@ -70,6 +75,7 @@ if 'win' in sys.platform:
     oleaut32 = ffi.dlopen('oleaut32')
     alloc_string = lambda x: oleaut32.SysAllocString(ffi.new('wchar_t[]', x))
     free_string = lambda x: oleaut32.SysFreeString(x)
+    string_byte_len = lambda x: oleaut32.SysStringByteLen(x)
 else:
     libcname = 'c'
     bstr_len_size = ffi.sizeof('uint32_t')
@@ -102,24 +108,44 @@ else:
             addr = ffi.cast('void*', addr)
         C.free(addr - bstr_len_size)
 
-log.info('dll_paths: %r', dll_paths)
-dll7z = None
-for dll_path in dll_paths:
-    log.debug('trying path: %s', dll_path)
-    try:
-        dll7z = ffi.dlopen(dll_path)
-    except:
-        dll7z = None
-    else:
-        break
+    def string_byte_len(bstr):
+        # 7-Zip's SysAllocStringByteLen stores the length in bytes right before the string
+        return ffi.cast('uint32_t*', bstr)[-1]
 
-if dll7z is None:
-    raise ImportError('Could not find 7z.dll/7z.so in: {}'.format(dll_paths))
+log.info('dll_paths: %r', dll_paths)
 
 #C = ffi.dlopen(None)
 C = ffi.dlopen(libcname)
 
+# 7z.dll/7z.so and the tables describing it are only loaded once something needs them, see __getattr__
+_load_lock = threading.RLock()
+_dll7z = None
+_tables = None
+#: path 7z.dll/7z.so was actually loaded from
+dll_path = None
+
+
+def load_dll():
+    """dlopen 7z.dll/7z.so the first time it's needed"""
+    global _dll7z, dll_path
+    if _dll7z is not None:
+        return _dll7z
+    with _load_lock:
+        if _dll7z is not None:
+            return _dll7z
+        for path in dll_paths:
+            log.debug('trying path: %s', path)
+            try:
+                dll = ffi.dlopen(path)
+            except OSError:
+                continue
+            dll_path = path
+            _dll7z = dll
+            return dll
+    raise ImportError('Could not find 7z.dll/7z.so in: {}'.format(dll_paths))
+
 from .winhelpers import get_prop_val, guidp2uuid, alloc_propvariant, RNOK
+from .signatures import SignatureIndex, split_multi_signature
 
 
 def get_prop(idx, propid, get_fn, prop_name, convert, istype=None):
@@ -154,7 +180,12 @@ def get_prop(idx, propid, get_fn, prop_name, convert, istype=None):
     return convert(val)
 
 
-get_bytes_prop = partial(get_prop, prop_name='pcVal', istype=VARTYPE.VT_BSTR, convert=ffi.string)
+def bstr_to_bytes(bstr) -> bytes:
+    """whole contents of a BSTR holding binary data (signatures), which may contain NULs"""
+    return ffi.buffer(ffi.cast('char*', bstr), string_byte_len(bstr))[:]
+
+
+get_bytes_prop = partial(get_prop, prop_name='bstrVal', istype=VARTYPE.VT_BSTR, convert=bstr_to_bytes)
 get_string_prop = partial(get_prop, prop_name='bstrVal', istype=VARTYPE.VT_BSTR, convert=ffi.string)
 get_classid = partial(get_prop, prop_name='puuid', istype=VARTYPE.VT_BSTR, convert=guidp2uuid)
 get_hex_prop = partial(get_prop, prop_name='ulVal', istype=VARTYPE.VT_UI4, convert=lambda x: hex(int(x)))
@@ -162,29 +193,57 @@ get_bool_prop = partial(get_prop, prop_name='bVal', istype=VARTYPE.VT_BOOL, conv
 get_uint64_prop = partial(get_prop, prop_name='uhVal', istype=VARTYPE.VT_UI8, convert=int)
 get_uint32_prop = partial(get_prop, prop_name='ulVal', istype=VARTYPE.VT_UI4, convert=lambda x: x)
 
-Format = namedtuple('Format', ('classid', 'extensions', 'index', 'start_signature'))
+
+def get_offset_prop(idx, propid, get_fn) -> int:
+    """
+    a VT_UI4 property, 0 if it's empty or of any other type: property ids moved between 7-Zip versions,
+    older builds have kAssociate (a VT_BOOL) where kSignatureOffset is now
+    """
+    tmp_pvar = alloc_propvariant()
+    as_pvar = ffi.cast('PROPVARIANT*', tmp_pvar)
+    RNOK(get_fn(idx, propid, as_pvar))
+    if as_pvar.vt != VARTYPE.VT_UI4:
+        log.debug('property %d of %d has type %d, taken as 0', propid, idx, as_pvar.vt)
+        return 0
+    return int(as_pvar.ulVal)
+
+#: signatures: every signature of the format, start_signature and those of a multi-signature,
+#: found signature_offset bytes into the file
+Format = namedtuple(
+    'Format', ('classid', 'extensions', 'index', 'start_signature', 'signatures', 'signature_offset'))
+
+
+def get_format(i: int, get_fn) -> Format:
+    start_signature = get_bytes_prop(i, FormatProps.kSignature, get_fn) or None
+    signatures = (start_signature,) if start_signature else ()
+    multi_signature = get_bytes_prop(i, FormatProps.kMultiSignature, get_fn)
+    if multi_signature:
+        signatures += split_multi_signature(multi_signature)
+    return Format(
+        classid=get_classid(i, FormatProps.kClassID, get_fn),
+        extensions=tuple(get_string_prop(i, FormatProps.kExtension, get_fn).split()),
+        index=i,
+        start_signature=start_signature,
+        signatures=signatures,
+        signature_offset=get_offset_prop(i, FormatProps.kSignatureOffset, get_fn),
+    )
 
 
 def get_format_info():
     log.debug('get_format_info()')
+    dll7z = load_dll()
     num_formats = ffi.new("uint32_t*")
     RNOK(dll7z.GetNumberOfFormats(num_formats))
     assert num_formats != ffi.NULL
     log.debug('GetNumberOfFormats() == %d', num_formats[0])
 
     return {
-        get_string_prop(i, FormatProps.kName, dll7z.GetHandlerProperty2):
-            Format(
-                classid=get_classid(i, FormatProps.kClassID, dll7z.GetHandlerProperty2),
-                extensions=tuple(get_string_prop(i, FormatProps.kExtension, dll7z.GetHandlerProperty2).split()),
-                index=i,
-                start_signature=get_bytes_prop(i, FormatProps.kStartSignature, dll7z.GetHandlerProperty2),
-            )
+        get_string_prop(i, FormatProps.kName, dll7z.GetHandlerProperty2): get_format(i, dll7z.GetHandlerProperty2)
         for i in range(num_formats[0])
     }
 
 
-def get_extensions_to_formats():
+def get_extensions_to_formats(formats):
     exts = {}
     for k, v in formats.items():
         for ext in v.extensions:
@@ -200,6 +259,7 @@ Method = namedtuple(
 
 def get_method_info():
     log.debug('getting methods')
+    dll7z = load_dll()
     num_methods = ffi.new('uint32_t*')
     RNOK(dll7z.GetNumberOfMethods(num_methods))
     assert num_methods != ffi.NULL
@@ -218,20 +278,149 @@ def get_method_info():
     log.debug('got method info')
 
 
-getting_meths = False
-log.debug('initializing')
-formats = get_format_info()
-extensions = get_extensions_to_formats()
-# print(formats.values())
-max_sig_size = max(len(f.start_signature or b'') for f in formats.values())
-getting_meths = True
-methods = get_method_info()
+Tables = namedtuple('Tables', ('formats', 'extensions', 'methods', 'max_sig_size', 'signatures'))
 
-'''
-from pprint import pprint
-from functools import partial
-pp = partial(pprint, indent=True)
-pp(methods)
-'''
+#: bump whenever what ends up in the cache changes
+TABLES_CACHE_VERSION = 2
+
+
+def tables_cache_path() -> Optional[str]:
+    """
+    where the format/method tables of the loaded 7z.dll/7z.so are cached,
+    None if caching is disabled (LIB7ZIP_NO_CACHE is set) or the library can't be stat'ed
+    """
+    if os.environ.get('LIB7ZIP_NO_CACHE'):
+        return None
+    load_dll()
+    try:
+        real_path = os.path.realpath(dll_path)
+        st = os.stat(real_path)
+    except OSError:
+        return None
+
+    cache_dir = os.environ.get('LIB7ZIP_CACHE_DIR')
+    if not cache_dir:
+        base = os.environ.get('LOCALAPPDATA' if sys.platform == 'win32' else 'XDG_CACHE_HOME')
+        cache_dir = os.path.join(base or os.path.expanduser('~/.cache'), 'lib7zip')
+    key = '{}:{}:{}:{}:{}'.format(TABLES_CACHE_VERSION, __version__, real_path, st.st_size, st.st_mtime_ns)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, 'tables-{}.json'.format(digest))
+
+
+def tables_to_json(formats, methods) -> dict:
+    def opt_str(value):
+        return None if value is None else str(value)
+
+    return {
+        'formats': {
+            name: [str(f.classid), list(f.extensions), f.index,
+                   None if f.start_signature is None else f.start_signature.hex(),
+                   [signature.hex() for signature in f.signatures], f.signature_offset]
+            for name, f in formats.items()
+        },
+        'methods': [
+            [m.name, m.id, opt_str(m.encoder), opt_str(m.decoder), m.encoder_assigned, m.decoder_assigned]
+            for m in methods
+        ],
+    }
+
+
+def tables_from_json(data: dict):
+    def opt_uuid(value):
+        return None if value is None else uuid.UUID(value)
+
+    formats = {
+        name: Format(
+            classid=uuid.UUID(classid),
+            extensions=tuple(exts),
+            index=index,
+            start_signature=None if signature is None else bytes.fromhex(signature),
+            signatures=tuple(bytes.fromhex(signature) for signature in signatures),
+            signature_offset=signature_offset,
+        )
+        for name, (classid, exts, index, signature, signatures, signature_offset) in data['formats'].items()
+    }
+    methods = [
+        Method(name, id, opt_uuid(encoder), opt_uuid(decoder), encoder_assigned, decoder_assigned)
+        for name, id, encoder, decoder, encoder_assigned, decoder_assigned in data['methods']
+    ]
+    return formats, methods
+
+
+def load_tables() -> Tables:
+    """
+    formats, extensions and methods supported by 7z.dll/7z.so
+
+    Enumerating them takes a few calls per format and codec, so they are cached on disk keyed by the library's
+    path, size and modification time, and only enumerated again when the library changes.
+    """
+    global _tables
+    if _tables is not None:
+        return _tables
+    with _load_lock:
+        if _tables is not None:
+            return _tables
+
+        cache_path = tables_cache_path()
+        formats = methods = None
+        if cache_path is not None:
+            try:
+                with open(cache_path, encoding='utf-8') as f:
+                    formats, methods = tables_from_json(json.load(f))
+                log.debug('format/method tables read from %s', cache_path)
+            except (OSError, ValueError, KeyError, TypeError):
+                formats = methods = None
+
+        if formats is None:
+            log.debug('initializing')
+            formats = get_format_info()
+            methods = get_method_info()
+            if cache_path is not None:
+                write_tables_cache(cache_path, formats, methods)
+
+        signatures = SignatureIndex(formats)
+        _tables = Tables(
+            formats=formats,
+            extensions=get_extensions_to_formats(formats),
+            methods=methods,
+            max_sig_size=signatures.read_size,
+            signatures=signatures,
+        )
+    return _tables
+
+
+def write_tables_cache(cache_path: str, formats, methods):
+    tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(tables_to_json(formats, methods), f)
+        os.replace(tmp_path, cache_path)
+    except OSError as ex:
+        log.debug('could not write %s: %r', cache_path, ex)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+_LAZY_ATTRS = {
+    'dll7z': load_dll,
+    'formats': lambda: load_tables().formats,
+    'extensions': lambda: load_tables().extensions,
+    'methods': lambda: load_tables().methods,
+    'max_sig_size': lambda: load_tables().max_sig_size,
+}
+
+
+def __getattr__(name):
+    """lib7zip.dll7z, formats, extensions, methods & max_sig_size are loaded on first access"""
+    try:
+        loader = _LAZY_ATTRS[name]
+    except KeyError:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name)) from None
+    return loader()
 
 from .archive import Archive  # noqa
+from .batch import test_many, extract_archives, ExtractJob  # noqa
+from .pool import ArchivePool  # noqa
@@ -0,0 +1,201 @@
+"""
+asyncio front end to Archive: every call into 7-Zip runs on a shared, bounded thread pool
+and decoded chunks reach the event loop through a bounded queue, so slow consumers hold back the decoder.
+
+    async with AsyncArchive('path_to.7z') as archive:
+        async for item in archive:
+            print(item.path, len(await item.read()))
+
+        async for chunk in archive[0].iter_chunks():
+            ...
+
+7-Zip archive objects aren't reentrant, so calls on one AsyncArchive are serialized by an asyncio.Lock,
+while different archives share the pool. A chunk iterator occupies a pool thread for as long as
+it is being consumed, close it (or break out of the async for) to release it.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import io
+import logging
+import os
+import threading
+from typing import AsyncIterator, Optional
+
+from .archive import Archive, ArchiveItem
+from .metadata import DEFAULT_PROPS
+from .reader import QUEUE_SIZE, ReaderClosed
+
+log = logging.getLogger(__name__)
+
+#: threads in the pool shared by every AsyncArchive not given its own executor
+MAX_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+_EOF = object()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """the thread pool shared by all AsyncArchives, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(MAX_WORKERS, thread_name_prefix='lib7zip-aio')
+        return _executor
+
+
+class AsyncQueueWriter:
+    """
+    File-like sink handing each chunk 7-Zip writes to an asyncio.Queue on loop,
+    blocking the decoder thread while the queue is full
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, chunks: asyncio.Queue, closed: threading.Event):
+        self.loop = loop
+        self.chunks = chunks
+        self.closed = closed
+
+    def put(self, value):
+        asyncio.run_coroutine_threadsafe(self.chunks.put(value), self.loop).result()
+
+    def write(self, buf) -> int:
+        if self.closed.is_set():
+            raise ReaderClosed()
+        self.put(bytes(buf))
+        return len(buf)
+
+
+class AsyncArchive:
+    """
+    Archive opened and read from asyncio code, see the module documentation.
+    Takes the same arguments as Archive, plus executor to run on instead of the shared pool.
+    """
+    def __init__(self, filename: os.PathLike, forcetype: str=None, password: str=None,
+                 executor: Optional[ThreadPoolExecutor]=None, **kwargs):
+        self.filename = filename
+        self.password = password
+        self.archive = None
+        self._open_args = dict(kwargs, forcetype=forcetype, password=password)
+        self._executor = executor
+        self._lock = asyncio.Lock()
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor or get_executor(), partial(fn, *args, **kwargs))
+
+    async def _run_locked(self, fn, *args, **kwargs):
+        async with self._lock:
+            return await self._run(fn, *args, **kwargs)
+
+    async def open(self) -> 'AsyncArchive':
+        if self.archive is None:
+            self.archive = await self._run(Archive, self.filename, **self._open_args)
+        return self
+
+    async def close(self):
+        async with self._lock:
+            if self.archive is not None:
+                archive, self.archive = self.archive, None
+                await self._run(archive.close)
+
+    async def __aenter__(self) -> 'AsyncArchive':
+        return await self.open()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def len(self) -> int:
+        return await self._run_locked(len, self.archive)
+
+    def __getitem__(self, index: int) -> 'AsyncArchiveItem':
+        """item by index, use get() to look items up by path"""
+        if not isinstance(index, int):
+            raise TypeError('AsyncArchive indices must be integers, use get() for paths')
+        return AsyncArchiveItem(self, self.archive[index])
+
+    async def get(self, index) -> 'AsyncArchiveItem':
+        """item by index or path, building the path index off the event loop the first time"""
+        return AsyncArchiveItem(self, await self._run_locked(self.archive.__getitem__, index))
+
+    async def __aiter__(self) -> AsyncIterator['AsyncArchiveItem']:
+        for index in range(await self.len()):
+            yield self[index]
+
+    async def metadata(self, props=DEFAULT_PROPS, numpy: bool=False) -> dict:
+        """see Archive.metadata"""
+        return await self._run_locked(self.archive.metadata, props, numpy)
+
+    async def extract(self, directory='', password=None, workers: int=None) -> bool:
+        """see Archive.extract"""
+        return await self._run_locked(self.archive.extract, directory, password, workers)
+
+    async def extract_many(self, items, sink_factory=None, password=None) -> dict:
+        """see Archive.extract_many, sink_factory is called on a pool thread"""
+        items = [item.item if isinstance(item, AsyncArchiveItem) else item for item in items]
+        return await self._run_locked(self.archive.extract_many, items, sink_factory, password)
+
+
+class AsyncArchiveItem:
+    """
+    ArchiveItem of an AsyncArchive. Properties (path, size, crc...) are read straight from the
+    wrapped ArchiveItem, they don't decode anything.
+    """
+    def __init__(self, archive: AsyncArchive, item: ArchiveItem):
+        self.archive = archive
+        self.item = item
+        self.index = item.index
+
+    def __getattr__(self, attr):
+        return getattr(self.item, attr)
+
+    async def read(self, password=None) -> bytes:
+        """the whole decoded item"""
+        stream = io.BytesIO()
+        await self.archive._run_locked(self.item.extract, stream, password)
+        return stream.getvalue()
+
+    async def extract(self, file, password=None):
+        """see ArchiveItem.extract, file is written to from a pool thread"""
+        await self.archive._run_locked(self.item.extract, file, password)
+
+    async def iter_chunks(self, password=None, queue_size: int=QUEUE_SIZE) -> AsyncIterator[bytes]:
+        """
+        chunks of the decoded item as 7-Zip produces them,
+        at most queue_size of them are buffered ahead of the consumer
+        """
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue(queue_size)
+        closing = threading.Event()
+        writer = AsyncQueueWriter(loop, chunks, closing)
+
+        def run():
+            try:
+                self.item.extract(writer, password)
+            except Exception as ex:
+                if not closing.is_set():
+                    log.debug('extraction of item %d failed: %r', self.index, ex)
+                    writer.put(ex)
+            else:
+                if not closing.is_set():
+                    writer.put(_EOF)
+
+        async with self.archive._lock:
+            future = loop.run_in_executor(self.archive._executor or get_executor(), run)
+            try:
+                while True:
+                    chunk = await chunks.get()
+                    if chunk is _EOF:
+                        break
+                    if isinstance(chunk, Exception):
+                        raise chunk
+                    yield chunk
+                await future
+            finally:
+                if not future.done():
+                    closing.set()
+                    # keep the queue drained until the decoder notices and gives up
+                    while not future.done():
+                        while not chunks.empty():
+                            chunks.get_nowait()
+                        await asyncio.wait({future}, timeout=0.01)
@@ -1,26 +1,42 @@
 import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from functools import partial
+import heapq
 import io
+import threading
+import time
+from tempfile import SpooledTemporaryFile
 from typing import Any, Optional, Iterator, IO
 from pathlib import Path, PurePath
 
 from . import (
-    ffi, dll7z, max_sig_size, formats, log, C, VARTYPE, extensions,
+    ffi, load_dll, load_tables, log, C, VARTYPE,
     free_string,
 )
 from . import py7ziptypes
 from .py7ziptypes import ArchiveProps, OperationResult
 
-from .winhelpers import uuid2guidp, get_prop_val, RNOK, RERR
+from .winhelpers import uuid2guidp, read_prop, RNOK, RERR, HRESULTException
 
 from .open_callback import ArchiveOpenCallback
+from .plan import ExtractionPlan
 from .extract_callback import (
     ArchiveExtractToDirectoryCallback,
-    ArchiveExtractToStreamCallback, ArchiveExtractCallback,
+    ArchiveExtractToStreamCallback, ArchiveExtractToSinksCallback, ArchiveExtractCallback, ArchiveTestCallback,
 )
-from .stream import FileInStream, WrapInStream
+from .stream import FileInStream, BufferInStream, BufferOutStream, WrapInStream
+from .simplecom import IUnknownImpl
 from .cmpcodecsinfo import CompressCodecsInfo
+from .metadata import DEFAULT_PROPS, MISSING, read_columns, columns_to_numpy
+from .pathindex import PathIndex
+from .reader import MemberReader, SeekableMemberReader, QUEUE_SIZE
 from .wintypes import HRESULT
+from .stats import Stats
+from .writebehind import WriteBehind
+from .volumes import DEFAULT_MAX_OPEN_VOLUMES, VolumePool, VolumeInStream, split_volumes
+from .cache import DEFAULT_CACHE_SIZE, MemberCache
 
 
 class ExtractionError(Exception):
@@ -37,94 +53,328 @@ class ArchiveOpenError(Exception):
     pass
 
 
+class ReaderLockError(RuntimeError):
+    """the archive is held by a reader from ArchiveItem.open() the calling thread has yet to read or close"""
+
+
+class ArchiveLock:
+    """
+    Reentrant lock behind Archive.lock.
+
+    A sequential reader from ArchiveItem.open() holds it on its decoder thread until decoding is done, and the
+    decoder waits whenever its queue is full: the thread that opened the reader would wait forever for a
+    reader only it can drain. Rather than block, acquiring raises ReaderLockError in that thread when the lock
+    is held by the decoder of one of its readers. While waiting for the lock the holder is checked again every
+    READER_CHECK_INTERVAL seconds, in case such a decoder gets it first.
+    """
+    READER_CHECK_INTERVAL = 0.05
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # thread ident and depth of the current holder, only changed by the holder
+        self._holder = None
+        self._depth = 0
+        # thread ident -> decoder threads of the readers it opened, until they're done
+        self._readers = {}
+        self._readers_lock = threading.Lock()
+
+    def reader_started(self, owner: int, decoder: threading.Thread):
+        with self._readers_lock:
+            self._readers.setdefault(owner, set()).add(decoder)
+
+    def reader_done(self, owner: int, decoder: threading.Thread):
+        with self._readers_lock:
+            decoders = self._readers[owner]
+            decoders.discard(decoder)
+            if not decoders:
+                del self._readers[owner]
+
+    def _held_by_reader_of(self, owner: int) -> bool:
+        holder = self._holder
+        with self._readers_lock:
+            return holder is not None and any(decoder.ident == holder for decoder in self._readers.get(owner, ()))
+
+    def acquire(self, blocking: bool=True, timeout: float=-1) -> bool:
+        me = threading.get_ident()
+        deadline = None if timeout < 0 else time.monotonic() + timeout
+        acquired = self._lock.acquire(False)
+        while not acquired and blocking:
+            if self._held_by_reader_of(me):
+                raise ReaderLockError(
+                    'archive is busy decoding for a reader this thread opened, read it to the end or close it first')
+            wait = self.READER_CHECK_INTERVAL
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    break
+            acquired = self._lock.acquire(True, wait)
+        if acquired:
+            self._holder = me
+            self._depth += 1
+        return acquired
+
+    def release(self):
+        self._depth -= 1
+        if not self._depth:
+            self._holder = None
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+#: how far into a file 7-Zip looks for an archive (after an SFX module...) when its format wasn't recognized
+MAX_CHECK_START_POSITION = 1 << 22
+
+class ArchiveProperty:
+    """property of the archive as a whole, read from 7-Zip on every access"""
+    __slots__ = ('propid',)
+
+    def __init__(self, prop: ArchiveProps):
+        self.propid = int(prop)
+
+    def __get__(self, archive, owner=None):
+        if archive is None:
+            return self
+        handler = archive.archive
+        return read_prop(handler.vtable.GetArchiveProperty, handler, self.propid)
+
+
+class ItemProperty(ArchiveProperty):
+    """property of an archive item, read from 7-Zip on every access"""
+    __slots__ = ()
+
+    def __get__(self, item, owner=None):
+        if item is None:
+            return self
+        handler = item.archive.archive
+        return read_prop(handler.vtable.GetProperty, handler, item.index, self.propid)
+
+
+def with_properties(descriptor):
+    """class decorator adding a descriptor for every ArchiveProps name the class doesn't already use"""
+    def decorate(cls):
+        for name, prop in ArchiveProps.__members__.items():
+            if not hasattr(cls, name):
+                setattr(cls, name, descriptor(prop))
+        return cls
+    return decorate
+
+
+#: outcome of testing one item, crc is None when the format doesn't store one
+ItemTestResult = namedtuple('ItemTestResult', ('index', 'path', 'crc', 'result'))
+
+
+@with_properties(ArchiveProperty)
 class Archive:
+    """
+    An archive opened with 7-Zip.
+
+    An Archive may be shared between threads. 7-Zip handlers aren't reentrant, so the calls that decode or
+    move its input stream (opening, extracting, opening members, closing) hold Archive.lock: extractions
+    from one archive run one after the other, extractions from different archives run in parallel, as 7-Zip
+    works without the GIL. Item properties and metadata() only read the headers parsed when opening and
+    don't lock. An ArchiveItem.open() reader holds the lock until it's read to the end or closed (meanwhile the
+    thread that opened it gets a ReaderLockError from anything waiting on the reader for the lock, see
+    ArchiveLock), an archive opened in place with ArchiveItem.open_archive() shares the lock of the archive
+    it's in.
+    """
     archive = None
-
-    def __init__(self, filename: os.PathLike, stream=None, in_stream=None, forcetype: str=None, password: str=None):
+    stream = None
+    volume_pool = None
+
+    def __init__(self, filename: os.PathLike, stream=None, in_stream=None, forcetype: str=None, password: str=None,
+                 stats=None, max_open_volumes: int=DEFAULT_MAX_OPEN_VOLUMES, max_check_start_position: int=None,
+                 cache_size: int=DEFAULT_CACHE_SIZE):
+        """
+        stats: True, or a stats.Stats object (possibly shared between archives), to count and time
+        every call between Python and 7-Zip for this archive, see Archive.stats()
+
+        Multi-volume archives are opened from their first volume (x.7z.001, x.part1.rar, x.zip next to x.z01...),
+        the other volumes are found next to it. At most max_open_volumes of them are kept open at a time.
+
+        Without forcetype the formats the file may be in are tried in turn (see rank_formats) until one opens it.
+        max_check_start_position: how far into the file 7-Zip looks for the start of the archive (past an SFX
+        module or other stub). By default that's 0 for a format whose signature was found where it belongs
+        and MAX_CHECK_START_POSITION otherwise.
+
+        cache_size: bytes of decoded members kept for ArchiveItem.contents, see read_cached() (0 to keep none).
+        """
+        #: serializes the calls that decode or move 7-Zip's input stream: Open, Extract, GetStream and Close
+        self.lock = ArchiveLock()
         self.password = password
+        self._stats = Stats() if stats is True else stats
         self.tmp_archive = ffi.new('void**')
-        self._path2idx = {}
+        self._path_index = None
         self._idx2itm = {}
         self._num_items = None
-        iid = uuid2guidp(py7ziptypes.IID_IInArchive)
-
-        filename = Path(filename)
-        if not in_stream:
-            self.stream = FileInStream(stream or filename)
+        self.cmp_codec_info = None
+        self.cache = MemberCache(cache_size)
+        # (block -> indices of its items, block of each item, size of each item), for read_cached()
+        self._block_layout = None
+
+        self.filename = filename = Path(filename)
+        # whether the archive can be opened again, e.g. by worker processes
+        self.reopenable = not in_stream and stream is None
+        self.volume_pool = VolumePool(max_open_volumes) if self.reopenable else None
+        volumes = split_volumes(filename) if self.reopenable else None
+        if volumes:
+            # the parts of a split archive, read as one: x.7z.001 is opened as x.7z
+            self.stream = VolumeInStream(self.volume_pool, volumes, self._stats)
+            stream_inst = self.stream.instances[py7ziptypes.IID_IInStream]
+            filename = filename.with_suffix('')
+        elif not in_stream:
+            self.stream = FileInStream(stream or filename, self._stats)
             stream_inst = self.stream.instances[py7ziptypes.IID_IInStream]
+        elif isinstance(in_stream, IUnknownImpl):
+            # keep our own stream implementation alive for as long as 7-Zip may call into it
+            self.stream = in_stream
+            stream_inst = in_stream.instances[py7ziptypes.IID_IInStream]
+        elif isinstance(in_stream, WrapInStream):
+            # one of 7-Zip's own streams (a member of another archive), holding a reference released on close
+            self.stream = in_stream
+            stream_inst = in_stream.instream
         else:
             self.stream = None
             stream_inst = in_stream
 
-        if forcetype is not None:
-            type_name = forcetype
-        else:
-            for type_name in self.guess_formats(
-                    filename, WrapInStream(stream_inst)):
-                break
+        try:
+            if forcetype is not None:
+                candidates = [(forcetype, False)]
+            else:
+                candidates = self.rank_formats(filename, WrapInStream(stream_inst))
+                if not candidates:
+                    raise FormatGuessError('failed to guess format')
+
+            log.debug('creating callback obj')
+            self.open_cb = callback = ArchiveOpenCallback(
+                password=password, stats=self._stats,
+                volume_path=filename if self.reopenable and not volumes else None, pool=self.volume_pool)
+            self.open_cb_i = callback.instances[py7ziptypes.IID_IArchiveOpenCallback]
+
+            # the next candidate is only tried when a handler doesn't recognize the file (S_FALSE),
+            # errors such as a failing stream or callback are raised right away
+            for type_name, signature_found in candidates:
+                if max_check_start_position is not None:
+                    check_start_position = max_check_start_position
+                elif signature_found:
+                    # the signature is right where the format has it, no need to look further for a stub/SFX module
+                    check_start_position = 0
+                else:
+                    check_start_position = MAX_CHECK_START_POSITION
+                if self._open_as(type_name, stream_inst, check_start_position):
+                    break
+                log.debug('%s is not a %s archive', filename, type_name)
             else:
-                raise FormatGuessError('failed to guess format')
+                raise ArchiveOpenError('open failed, tried: {}'.format(', '.join(name for name, _ in candidates)))
+        except BaseException:
+            # don't leave the input open (or a caller's buffer exported) until the traceback goes away
+            self._close_inputs()
+            raise
+        archive = self.archive
+        self.itm_prop_fn = partial(archive.vtable.GetProperty, archive)
+        #log.debug('what now?')
+
+        #import pdb; pdb.set_trace()
+        #archive.vtable = old_vtable
+        #tmp_archive2 = ffi.new('void**')
+        #RNOK(self.archive.vtable.QueryInterface(archive, iid, tmp_archive2))
+        #self.archive = archive = ffi.cast('IInArchive*', tmp_archive2[0])
+        #self.tmp_archive = tmp_archive2
 
-        self.type_name = type_name
-        format = formats[type_name]
+        assert archive.vtable.GetNumberOfItems != ffi.NULL
+        assert archive.vtable.GetProperty != ffi.NULL
+        log.debug('successfully opened archive')
+
+    def _open_as(self, type_name: str, stream_inst, max_check_start_position: int) -> bool:
+        """try to open stream_inst with the handler of format type_name, False if it isn't in that format"""
+        format = load_tables().formats[type_name]
         classid = uuid2guidp(format.classid)
 
         log.debug('Create Archive (class=%r, iface=%r)',
                   format.classid,
                   py7ziptypes.IID_IInArchive)
 
-        RNOK(dll7z.CreateObject(classid, iid, self.tmp_archive))
+        RNOK(load_dll().CreateObject(classid, uuid2guidp(py7ziptypes.IID_IInArchive), self.tmp_archive))
         assert self.tmp_archive[0] != ffi.NULL
-        self.archive = archive = ffi.cast('IInArchive*', self.tmp_archive[0])
+        archive = ffi.cast('IInArchive*', self.tmp_archive[0])
         archive.vtable.AddRef(archive)
 
         assert archive.vtable.GetNumberOfItems != ffi.NULL
         assert archive.vtable.GetProperty != ffi.NULL
 
-        log.debug('creating callback obj')
-        self.open_cb = callback = ArchiveOpenCallback(password=password)
-        self.open_cb_i = callback_inst = callback.instances[py7ziptypes.IID_IArchiveOpenCallback]
-
-
         set_cmpcodecsinfo_ptr = ffi.new('void**')
         archive.vtable.QueryInterface(
             archive, uuid2guidp(py7ziptypes.IID_ISetCompressCodecsInfo), set_cmpcodecsinfo_ptr)
 
         if set_cmpcodecsinfo_ptr != ffi.NULL and set_cmpcodecsinfo_ptr[0] != ffi.NULL:
             log.debug('Setting Compression Codec Info')
-            self.set_cmpcodecs_info = set_cmpcodecsinfo = \
-                ffi.cast('ISetCompressCodecsInfo*', set_cmpcodecsinfo_ptr[0])
+            set_cmpcodecsinfo = ffi.cast('ISetCompressCodecsInfo*', set_cmpcodecsinfo_ptr[0])
 
-            #TODO...
-            cmp_codec_info = CompressCodecsInfo()
-            cmp_codec_info_inst = cmp_codec_info.instances[py7ziptypes.IID_ICompressCodecsInfo]
+            # 7-Zip keeps calling it for as long as the archive is open
+            if self.cmp_codec_info is None:
+                self.cmp_codec_info = CompressCodecsInfo()
+            cmp_codec_info_inst = self.cmp_codec_info.instances[py7ziptypes.IID_ICompressCodecsInfo]
             set_cmpcodecsinfo.vtable.SetCompressCodecsInfo(set_cmpcodecsinfo, cmp_codec_info_inst)
             log.debug('compression codec info set')
         else:
-            self.set_cmpcodecs_info = None
+            set_cmpcodecsinfo = None
 
         #old_vtable = archive.vtable
-        log.debug('opening archive')
-        maxCheckStartPosition = ffi.new('uint64_t*', 1 << 22)
-        res = RERR(archive.vtable.Open(archive, stream_inst, maxCheckStartPosition, callback_inst))
-        if not res:
-            raise ArchiveOpenError('open failed')
-        self.itm_prop_fn = partial(archive.vtable.GetProperty, archive)
-        #log.debug('what now?')
+        log.debug('opening archive as %s', type_name)
+        maxCheckStartPosition = ffi.new('uint64_t*', max_check_start_position)
+        res = False
+        try:
+            # handlers start reading wherever the stream is
+            WrapInStream(stream_inst).seek(0)
+            with self.lock, self._native('Open'):
+                res = RERR(archive.vtable.Open(archive, stream_inst, maxCheckStartPosition, self.open_cb_i))
+        finally:
+            if not res:
+                archive.vtable.Close(archive)
+                if set_cmpcodecsinfo is not None:
+                    set_cmpcodecsinfo.vtable.Release(set_cmpcodecsinfo)
+                archive.vtable.Release(archive)
+                archive.vtable.Release(archive)
+        if res:
+            self.archive = archive
+            self.set_cmpcodecs_info = set_cmpcodecsinfo
+            self.type_name = type_name
+        return res
 
-        #import pdb; pdb.set_trace()
-        #archive.vtable = old_vtable
-        #tmp_archive2 = ffi.new('void**')
-        #RNOK(self.archive.vtable.QueryInterface(archive, iid, tmp_archive2))
-        #self.archive = archive = ffi.cast('IInArchive*', tmp_archive2[0])
-        #self.tmp_archive = tmp_archive2
+    @classmethod
+    def from_buffer(cls, buffer, filename: os.PathLike='', forcetype: str=None, password: str=None,
+                    stats=None) -> 'Archive':
+        """
+        Open an archive held in memory by any object supporting the buffer protocol
+        (bytes, bytearray, mmap, multiprocessing.shared_memory, numpy arrays...) without copying it.
+
+        filename is optional and only used to guess the format from its extension.
+        """
+        if stats is True:
+            stats = Stats()
+        return cls(filename, in_stream=BufferInStream(buffer, stats), forcetype=forcetype, password=password,
+                   stats=stats)
+
+    def stats(self) -> Optional[dict]:
+        """snapshot of the counters collected for this archive (see stats.Stats), None unless opened with stats"""
+        if self._stats is None:
+            return None
+        return self._stats.snapshot()
 
-        assert archive.vtable.GetNumberOfItems != ffi.NULL
-        assert archive.vtable.GetProperty != ffi.NULL
-        log.debug('successfully opened archive')
+    def _native(self, op: str):
+        """context timing a call into 7-Zip when stats are on"""
+        if self._stats is None:
+            return nullcontext()
+        return self._stats.native(op)
 
     @staticmethod
     def formats_by_path(path: PurePath) -> Iterator[str]:
+        extensions = load_tables().extensions
         for suffix in reversed(path.suffixes):
             names = extensions.get(suffix.lstrip('.'), None)
             if names is not None:
@@ -132,44 +382,40 @@ class Archive:
 
     @classmethod
     def guess_formats(cls, filename: PurePath, file: IO[bytes]) -> Iterator[str]:
-        log.debug('guess format')
+        """names of the formats file may be in, most likely first, see rank_formats"""
+        for name, _ in cls.rank_formats(filename, file):
+            yield name
 
-        format_names = set(cls.formats_by_path(filename))
-        # FIXME: sync to 7-zip preference
-        if 'Iso' in format_names and 'Udf' in format_names:
-            # UDF is preferred over ISO
-            format_names = list(format_names)
-            iso_idx = format_names.index('Iso')
-            udf_idx = format_names.index('Udf')
-            if iso_idx < udf_idx:
-                format_names[iso_idx], format_names[udf_idx] = \
-                    format_names[udf_idx], format_names[iso_idx]
+    @classmethod
+    def rank_formats(cls, filename: PurePath, file: IO[bytes]) -> list[tuple[str, bool]]:
+        """
+        (format name, whether its signature was found) for every format file may be in, most likely first:
+        the formats of its extension whose signature is found, then the others of its extension
+        and finally any other format whose signature is found (longest signatures first). Udf always
+        comes before Iso.
+        """
+        log.debug('guess format')
+        tables = load_tables()
+        format_names = list(dict.fromkeys(cls.formats_by_path(filename)))
         file.seek(0)
-        sigcmp = file.read(max_sig_size)
-        startswith = sigcmp.startswith
+        head = file.read(tables.max_sig_size)
         file.seek(0)
         del file
-        yielded = set()
-
-        def filter_unique(name):
-            if name not in yielded:
-                yield name
-            yielded.add(name)
-
-        def filter_applicable_format(name, format):
-            if format.start_signature and startswith(format.start_signature):
-                yield from filter_unique(name)
-
-        for name in format_names:
-            yield from filter_applicable_format(name, formats[name])
 
-        for name in format_names:
-            yield from filter_unique(name)
-
-        for name, format in formats.items():
-            if name in format_names:
-                continue
-            yield from filter_applicable_format(name, format)
+        found = tables.signatures.match(head)
+        found_set = set(found)
+        extension_set = set(format_names)
+        ranked = (
+            [(name, True) for name in found if name in extension_set]
+            + [(name, False) for name in format_names if name not in found_set]
+            + [(name, True) for name in found if name not in extension_set]
+        )
+        names = [name for name, _ in ranked]
+        if 'Iso' in names and 'Udf' in names and names.index('Iso') < names.index('Udf'):
+            # UDF is preferred over ISO like 7-Zip does: the Iso handler accepts UDF bridge images too,
+            # but only shows their ISO9660/Joliet view
+            ranked.insert(names.index('Iso'), ranked.pop(names.index('Udf')))
+        return ranked
 
     def __enter__(self, *args, **kwargs):
         return self
@@ -178,18 +424,33 @@ class Archive:
         self.close()
 
     def __del__(self):
-        self.close()
+        try:
+            self.close()
+        except ReaderLockError:
+            # collected on a thread whose reader is decoding from this archive: close it from another thread,
+            # which just waits for the decoder to be done
+            threading.Thread(target=self.close, name='lib7zip-close', daemon=True).start()
 
     def close(self):
         log.debug('Archive.close()')
-        if self.archive is None:
-            return
-        if not self.archive or not self.archive.vtable or self.archive.vtable.Close == ffi.NULL:
-            log.warn('close failed, NULLs')
-            return
-        RERR(self.archive.vtable.Close(self.archive))
-        self.archive.vtable.Release(self.archive)
-        self.archive = None
+        with self.lock:
+            if self.archive is None:
+                # never opened, or open failed
+                self._close_inputs()
+                return
+            if not self.archive or not self.archive.vtable or self.archive.vtable.Close == ffi.NULL:
+                log.warn('close failed, NULLs')
+                return
+            RERR(self.archive.vtable.Close(self.archive))
+            self.archive.vtable.Release(self.archive)
+            self.archive = None
+            self._close_inputs()
+
+    def _close_inputs(self):
+        if self.stream is not None:
+            self.stream.close()
+        if self.volume_pool is not None:
+            self.volume_pool.close()
 
     def __len__(self):
         if self._num_items is None:
@@ -207,9 +468,8 @@ class Archive:
         try:
             return self._idx2itm[index]
         except KeyError:
-            itm = ArchiveItem(self, index)
-            self._idx2itm[index] = itm
-            return itm
+            # another thread may have got there first, there must be only one item per index
+            return self._idx2itm.setdefault(index, ArchiveItem(self, index))
 
     def __getitem__(self, index):
         if isinstance(index, int):
@@ -217,15 +477,32 @@ class Archive:
                 raise IndexError(index)
             return self.get_by_index(index)
         else:
-            if index not in self._path2index:
-                found_path = False
-                for item in self:
-                    if item.path == index:
-                        self._path2index[index] = item.index
-                        found_path = True
-                if not found_path:
-                    raise KeyError(index)
-            return self.get_by_index(self._path2index[index])
+            return self.get_by_index(self.path_index.lookup(index))
+
+    @property
+    def path_index(self) -> PathIndex:
+        """index of all item paths, built from one metadata snapshot the first time it's needed"""
+        if self._path_index is None:
+            self._build_path_index()
+        return self._path_index
+
+    def _build_path_index(self, columns: Optional[dict]=None):
+        """build the path index from columns holding path and is_dir, read from the archive if not given"""
+        if columns is None:
+            columns = self.metadata(('path', 'is_dir'))
+        self._path_index = PathIndex(columns['path'], (is_dir == 1 for is_dir in columns['is_dir']))
+
+    def exists(self, path: str) -> bool:
+        """whether path is an item in the archive, or a directory implied by one"""
+        return self.path_index.exists(path)
+
+    def listdir(self, path: str='') -> list[str]:
+        """sorted names of the entries directly inside directory path ('' is the root of the archive)"""
+        return self.path_index.listdir(path)
+
+    def glob(self, pattern: str) -> list[str]:
+        """paths of the items matching pattern, * and ? stop at separators, ** matches any number of directories"""
+        return self.path_index.glob(pattern)
 
     def __iter__(self):
         log.debug('iter(Archive)')
@@ -236,11 +513,32 @@ class Archive:
         #crc = get_hex_prop(i, py7ziptypes.kpidCRC, self.itm_prop_fn)
         #yield isdir, path, crc
 
-    def __getattr__(self, attr):
-        propid = getattr(py7ziptypes.ArchiveProps, attr)
-        return get_prop_val(
-            partial(self.archive.vtable.GetArchiveProperty,
-                    self.archive, propid))
+    def walk(self, max_depth: int=None, password=None) -> Iterator[tuple[tuple[str, ...], 'ArchiveItem']]:
+        """
+        Every item of the archive and, recursively, of the archives inside it, as (path, item) where path is
+        the tuple of member paths leading to the item, e.g. ('disk.iso', 'src.zip', 'src.tar.gz', 'src.tar', 'a.c').
+
+        Members with an extension 7-Zip knows are opened in place with ArchiveItem.open_archive(), those that
+        don't open are yielded as plain files. A nested archive is closed as soon as the walk leaves it,
+        its items are only usable until then. max_depth limits how many levels are descended (0: none).
+        """
+        return self._walk((), max_depth, password)
+
+    def _walk(self, parents, max_depth, password):
+        for item in self:
+            path = parents + (item.path or self.filename.stem,)
+            yield path, item
+            if item.is_dir or max_depth is not None and max_depth <= 0:
+                continue
+            if not any(self.formats_by_path(PurePath(path[-1]))):
+                continue
+            try:
+                nested = item.open_archive(password)
+            except (FormatGuessError, ArchiveOpenError, ExtractionError, HRESULTException) as ex:
+                log.debug('%r is not an archive: %r', path, ex)
+                continue
+            with nested:
+                yield from nested._walk(path, None if max_depth is None else max_depth - 1, password)
 
     @property
     def arc_props_len(self) -> int:
@@ -269,7 +567,7 @@ class Archive:
 
     def iter_arc_props(self) -> Iterator[tuple[Optional[str], ArchiveProps, VARTYPE, Any]]:
         for name, prop, vt in self.iter_arc_props_info():
-            val = get_prop_val(partial(self.archive.vtable.GetArchiveProperty, self.archive, prop))
+            val = read_prop(self.archive.vtable.GetArchiveProperty, self.archive, prop)
             yield name, prop, vt, val
 
     @property
@@ -297,7 +595,35 @@ class Archive:
         for i in range(self.props_len):
             yield self.get_prop_info(i)
 
-    def extract(self, directory='', password=None) -> bool:
+    def metadata(self, props=DEFAULT_PROPS, numpy: bool=False) -> dict:
+        """
+        Snapshot of props for every item in the archive, as one column per property keyed by name.
+
+        Much cheaper than iterating over ArchiveItems for large archives: a single PROPVARIANT is reused
+        and no per-item objects are created. Paths and other strings are lists (None when missing),
+        numbers are array('q') (MISSING when missing), booleans array('b') and times raw FILETIME ticks
+        (see winhelpers.filetime_to_datetime). With numpy=True arrays are returned as numpy views instead.
+        """
+        log.debug('Archive.metadata(%r)', props)
+        vartypes = {prop: vt for _, prop, vt in self.iter_props_info()}
+        columns = read_columns(self.archive, len(self), props, vartypes)
+        if numpy:
+            columns = columns_to_numpy(columns)
+        return columns
+
+    def extract(self, directory='', password=None, workers: int=None, hashes=None,
+                include=None, exclude=None, predicate=None, indices=None, write_behind=None):
+        """
+        Extract every item to directory, or only those picked by include, exclude, predicate and indices
+        (see select), still with a single pass over the archive.
+
+        workers: use that many processes, each opening the archive on its own and decoding a share of its
+        independent decode units (see decode_units), only for archives opened from a path.
+        hashes: names of hashlib algorithms (e.g. ['sha256']) computed over each file as it is written,
+        {index: {algorithm: hex digest}} of every file extracted is then returned instead of True.
+        write_behind: open, write and close files on a pool of writer threads while 7-Zip keeps decoding,
+        True for the defaults, a number of threads or a writebehind.WriteBehind to share between extractions.
+        """
         log.debug('Archive.extract()')
         '''
                 IInArchive::Extract:
@@ -307,61 +633,402 @@ class Archive:
         '''
 
         password = password or self.password
+        if include is not None or exclude is not None or predicate is not None or indices is not None:
+            indices = self.select(include, exclude, predicate, indices)
+        if workers is not None and workers > 1:
+            return self._extract_parallel(directory, password, workers, hashes, indices, write_behind)
+        return self._extract_to_directory(directory, password, indices, hashes, write_behind)
+
+    def select(self, include=None, exclude=None, predicate=None, indices=None) -> list[int]:
+        """
+        Sorted indices of the items matching every criterion given:
+        include and exclude are glob patterns (or lists of them) over item paths, as in glob(),
+        predicate is called with each remaining ArchiveItem and indices limits the selection to a set of indices.
+        """
+        if isinstance(include, str):
+            include = [include]
+        if isinstance(exclude, str):
+            exclude = [exclude]
+
+        if include is not None:
+            selected = set()
+            for pattern in include:
+                selected.update(self.path_index.match(pattern))
+        else:
+            selected = set(range(len(self)))
+        if indices is not None:
+            selected &= set(indices)
+        for pattern in exclude or ():
+            selected.difference_update(self.path_index.match(pattern))
+        if predicate is not None:
+            selected = [index for index in selected if predicate(self[index])]
+        return sorted(selected)
+
+    def _extract_to_directory(self, directory, password, indices=None, hashes=None, write_behind=None):
+        if isinstance(write_behind, WriteBehind):
+            writer, own_writer = write_behind, False
+        elif write_behind:
+            writer, own_writer = WriteBehind() if write_behind is True else WriteBehind(write_behind), True
+        else:
+            writer, own_writer = None, False
 
-        callback = ArchiveExtractToDirectoryCallback(self, directory, password)
-        if self.extract_with_callback(callback):
-            if callback.res != OperationResult.kOK:
-                raise ExtractionError(callback.res)
-            return True
+        callback = ArchiveExtractToDirectoryCallback(
+            self, directory, password, self._stats, hashes, indices, writer=writer)
+        try:
+            ok = self.extract_with_callback(callback, indices)
+        finally:
+            try:
+                if writer is not None:
+                    try:
+                        # only this extraction's writes, and errors, on a shared writer
+                        writer.drain(callback.write_group)
+                    finally:
+                        if own_writer:
+                            writer.close()
+            finally:
+                callback.plan.apply_metadata()
+        if ok:
+            for res in callback.results.values():
+                if res != OperationResult.kOK:
+                    raise ExtractionError(res)
+            return callback.digests if hashes else True
         return False
 
-    def extract_with_callback(self, callback: ArchiveExtractCallback) -> bool:
+    def decode_units(self) -> list[list[int]]:
+        """
+        Item indices grouped into units that can be decoded independently of each other:
+        one per solid block, plus one per item that isn't part of a block
+        (every item of non-solid formats such as zip, empty files, directories).
+        """
+        columns = self.metadata(('block',))
+        blocks = {}
+        units = []
+        for index, block in enumerate(columns['block']):
+            if block == MISSING:
+                units.append([index])
+            else:
+                blocks.setdefault(block, []).append(index)
+        return list(blocks.values()) + units
+
+    def _extract_parallel(self, directory, password, workers: int, hashes=None, indices=None, write_behind=None):
+        if not self.reopenable:
+            raise ValueError('parallel extraction needs an archive opened from a path')
+
+        columns = self.metadata(('size', 'is_dir'))
+        sizes = columns['size']
+        # directories are made here once every worker is done: their mtime has to be set after all the files
+        # in them are written, whichever process writes them
+        dirs = [index for index, is_dir in enumerate(columns['is_dir']) if is_dir == 1]
+        selected = set(range(len(sizes)) if indices is None else indices)
+        dirs = [index for index in dirs if index in selected]
+        selected.difference_update(dirs)
+        units = self.decode_units()
+        units = [unit for unit in ([index for index in unit if index in selected] for unit in units) if unit]
+        units = sorted(
+            ((sum(max(sizes[index], 0) for index in unit), unit) for unit in units),
+            key=lambda unit: unit[0], reverse=True)
+        # largest unit first onto the least loaded worker
+        loads = [(0, n, []) for n in range(min(workers, len(units)))]
+        heapq.heapify(loads)
+        for size, unit in units:
+            load, n, indices = heapq.heappop(loads)
+            indices.extend(unit)
+            heapq.heappush(loads, (load + size, n, indices))
+
+        if isinstance(write_behind, WriteBehind):
+            # each process needs its own threads
+            write_behind = write_behind.workers
+        log.debug('extracting %d units with %d workers', len(units), len(loads))
+        results = []
+        try:
+            if loads:
+                with ProcessPoolExecutor(len(loads)) as executor:
+                    futures = [
+                        executor.submit(
+                            _extract_worker, os.fspath(self.filename), self.type_name, password, directory,
+                            sorted(indices), hashes, write_behind)
+                        for _, _, indices in loads
+                    ]
+                    results = [future.result() for future in futures]
+        finally:
+            if dirs:
+                plan = ExtractionPlan(self, directory, dirs)
+                plan.make_dirs()
+                for index in dirs:
+                    plan.dir_done(index)
+                plan.apply_metadata()
+        if any(result is False for result in results):
+            return False
+        if not hashes:
+            return True
+        digests = {}
+        for result in results:
+            digests.update(result)
+        return dict(sorted(digests.items()))
+
+    def extract_many(self, items, sink_factory=None, password=None) -> dict:
+        """
+        Extract several items with a single IInArchive::Extract call,
+        so solid blocks are decoded once rather than once per item.
+
+        items are ArchiveItems or indices. sink_factory is called with each ArchiveItem and returns where it goes:
+        a path, a writable file-like object, a callable receiving every chunk as a memoryview
+        (only valid during the call) or None to skip the item.
+        If sink_factory is a dict, or omitted, the contents of every item are stored in it as bytes keyed by index.
+
+        Returns the dict of sinks (or contents) keyed by index, raises ExtractionError if any item failed.
+        """
+        log.debug('Archive.extract_many()')
+        password = password or self.password
+        indices = sorted({item if isinstance(item, int) else item.index for item in items})
+
+        if sink_factory is None or isinstance(sink_factory, dict):
+            contents = {} if sink_factory is None else sink_factory
+            sinks = {index: io.BytesIO() for index in indices}
+        else:
+            contents = None
+            sinks = {index: sink_factory(self[index]) for index in indices}
+
+        callback = ArchiveExtractToSinksCallback(sinks, password, self._stats)
+        self.extract_with_callback(callback, indices)
+        for res in callback.results.values():
+            if res != OperationResult.kOK:
+                raise ExtractionError(res)
+
+        if contents is None:
+            return sinks
+        for index, sink in sinks.items():
+            contents[index] = sink.getvalue()
+        return contents
+
+    def read_cached(self, index: int, password=None) -> bytes:
+        """
+        Contents of item index, from the member cache when there.
+
+        Decoding an item of a solid block decodes every item before it in the block, those that are small
+        enough for the cache and not in it yet are captured along (see cache.MemberCache), so reading
+        the items of a block one by one decodes it about once instead of once per item.
+        """
+        data = self.cache.get(index)
+        if data is not None:
+            return data
+
+        siblings = self._uncached_siblings(index)
+        if siblings:
+            try:
+                contents = self.extract_many(siblings + [index], password=password)
+            except ExtractionError as ex:
+                # a sibling may be what failed
+                log.debug('capturing the siblings of item %d failed: %r', index, ex)
+            else:
+                for sibling in siblings:
+                    self.cache.put(sibling, contents[sibling], sibling=True)
+                self.cache.put(index, contents[index])
+                return contents[index]
+
+        data = self.extract_many([index], password=password)[index]
+        self.cache.put(index, data)
+        return data
+
+    def _uncached_siblings(self, index: int) -> list[int]:
+        """items decoded before index in its solid block the cache would take, within its budget for siblings"""
+        if self.cache.max_bytes <= 0:
+            return []
+        if self._block_layout is None:
+            columns = self.metadata(('block', 'size'))
+            blocks = {}
+            for item_index, block in enumerate(columns['block']):
+                if block != MISSING:
+                    blocks.setdefault(block, []).append(item_index)
+            self._block_layout = blocks, columns['block'], columns['size']
+        blocks, block_of, sizes = self._block_layout
+        block = block_of[index]
+        if block == MISSING:
+            return []
+
+        siblings = []
+        budget = self.cache.max_siblings_size
+        for sibling in blocks[block]:
+            if sibling >= index:
+                # 7-Zip stops decoding the block once past the last item asked for
+                break
+            size = sizes[sibling]
+            if sibling in self.cache or not self.cache.admits(size, sibling=True) or size > budget:
+                continue
+            siblings.append(sibling)
+            budget -= size
+        return siblings
+
+    def test(self, password=None, indices=None) -> list[ItemTestResult]:
+        """
+        Decode every item (or only indices) and check it against its CRC without writing anything,
+        like `7z t`. Returns the result of every item tested, failures are reported rather than raised.
+        """
+        log.debug('Archive.test()')
+        password = password or self.password
+        if indices is not None:
+            indices = sorted(indices)
+        callback = ArchiveTestCallback(password, self._stats)
+        self.extract_with_callback(callback, indices, test_mode=True)
+
+        columns = self.metadata(('path', 'crc'))
+        paths, crcs = columns['path'], columns['crc']
+        return [
+            ItemTestResult(index, paths[index], None if crcs[index] == MISSING else crcs[index], res)
+            for index, res in sorted(callback.results.items())
+        ]
+
+    def extract_with_callback(self, callback: ArchiveExtractCallback, indices=None, test_mode: bool=False) -> bool:
+        """
+        run IInArchive::Extract with callback, over every item or only over indices (which must be sorted).
+        In test_mode 7-Zip asks callback for no output streams, it only decodes and checks.
+        """
         callback_inst = callback.instances[py7ziptypes.IID_IArchiveExtractCallback]
         assert self.archive.vtable.Extract != ffi.NULL
-        return RERR(self.archive.vtable.Extract(self.archive, ffi.NULL, 0xFFFFFFFF, 0, callback_inst))
+        if indices is None:
+            indices_arr, num_items = ffi.NULL, 0xFFFFFFFF
+        else:
+            indices_arr, num_items = ffi.new('uint32_t[]', indices), len(indices)
+        with self.lock, self._native('Extract'):
+            return RERR(self.archive.vtable.Extract(
+                self.archive, indices_arr, num_items, 1 if test_mode else 0, callback_inst))
 
 
+def _extract_worker(filename, forcetype, password, directory, indices, hashes=None, write_behind=None):
+    with Archive(filename, forcetype=forcetype, password=password) as archive:
+        return archive._extract_to_directory(directory, password, indices, hashes, write_behind)
+
+
+#: members opened as archives and spooled are kept in memory up to this size, then written to a temporary file
+SPOOL_SIZE = 64 << 20
+
+
+@with_properties(ItemProperty)
 class ArchiveItem():
     def __init__(self, archive, index):
         self.archive = archive
         self.index = index
-        self._contents = None
         self.password = None
 
-    def extract(self, file, password=None):
+    def extract(self, file, password=None, hashes=None) -> Optional[dict]:
+        """
+        extract the item to file, a path or a writable file-like object.
+        hashes: names of hashlib algorithms computed over the item as it is written, {algorithm: hex digest} is returned
+        """
+        callback = self._extract_to(file, password, hashes)
+        if hashes:
+            return callback.digests.get(self.index, {})
+        return None
+    #C.free(indices_p)
+
+    def extract_into(self, buffer, offset: int=0, password=None) -> int:
+        """
+        Decode the item straight into buffer from offset on, any writable object supporting the buffer protocol:
+        bytearray, mmap, multiprocessing.shared_memory, a numpy array allocated from the size property...
+        Each chunk is copied once, from 7-Zip's buffer to its place in buffer.
+
+        Returns the number of bytes written, raises ValueError (before decoding anything, when the item's
+        size is known) or BufferError if the item doesn't fit.
+        """
+        stream = BufferOutStream(buffer, offset, self.archive._stats)
+        try:
+            size = self.size
+            if size is not None and size > stream.capacity:
+                raise ValueError('item {} is {} bytes, only {} fit in the buffer'.format(
+                    self.index, size, stream.capacity))
+            try:
+                self._extract_to(stream, password)
+            except HRESULTException:
+                if isinstance(stream.error, BufferError):
+                    raise stream.error from None
+                raise
+            return stream.written
+        finally:
+            stream.close()
+
+    def _extract_to(self, file, password=None, hashes=None) -> ArchiveExtractToStreamCallback:
         password = password or self.password or self.archive.password
 
-        self.callback = callback = ArchiveExtractToStreamCallback(file, self.index, password)
-        self.cb_inst = callback_inst = callback.instances[py7ziptypes.IID_IArchiveExtractCallback]
+        # kept local: the item is shared, other threads may be extracting it as well
+        callback = ArchiveExtractToStreamCallback(file, self.index, password, self.archive._stats, hashes)
+        callback_inst = callback.instances[py7ziptypes.IID_IArchiveExtractCallback]
         indices = ffi.new('uint32_t[]', [self.index])
 
         log.debug('starting extract of %s!', self.path)
-        RNOK(self.archive.archive.vtable.Extract(self.archive.archive, indices, 1, 0, callback_inst))
+        with self.archive.lock, self.archive._native('Extract'):
+            RNOK(self.archive.archive.vtable.Extract(self.archive.archive, indices, 1, 0, callback_inst))
         log.debug('finished extract')
         if callback.res != OperationResult.kOK:
             raise ExtractionError(callback.res)
-    #C.free(indices_p)
+        return callback
+
+    def open(self, password=None, queue_size: int=QUEUE_SIZE, seekable: bool=False) -> io.RawIOBase:
+        """
+        File-like object (io.RawIOBase) reading the decoded item as a stream.
+
+        Decoding happens on a background thread and at most queue_size chunks are held in memory at a time.
+        Wrap it in io.BufferedReader for small reads, close it to stop decoding early.
+        That thread holds the archive's lock until decoding is done: other threads wait for the reader to be
+        read to the end or closed before they can extract from the archive, the thread that opened it gets
+        a ReaderLockError instead (it would otherwise wait on itself).
+
+        With seekable, items the handler can read in place (tar, iso, udf, vhd, stored zip entries...) are opened
+        for random access instead (see reader.SeekableMemberReader), nothing is decoded ahead of what's read
+        and the lock is only held during each read or seek.
+        Other items still get the sequential reader, check seekable() on what's returned.
+        """
+        if seekable:
+            in_stream = self.get_in_stream()
+            if in_stream is not None:
+                return SeekableMemberReader(self, in_stream)
+            log.debug('no seekable stream for item %d, reading it sequentially', self.index)
+        return MemberReader(self, password, queue_size)
+
+    def open_archive(self, password=None, forcetype: str=None, spool_size: int=SPOOL_SIZE) -> Archive:
+        """
+        Open the item as an archive of its own, reading it straight out of this one when the handler
+        can hand out a seekable stream over it (tar, iso, stored zip members...). Otherwise the item is
+        decoded into a temporary file kept in memory up to spool_size bytes.
+
+        password is the one of the inner archive. The outer archive must stay open while the inner one is in use.
+        """
+        name = self.path or self.archive.filename.stem
+        stats = self.archive._stats
+        with self.archive.lock:
+            in_stream = self.get_in_stream()
+            if in_stream is not None:
+                stream = WrapInStream(in_stream)
+                # the wrapper holds its own reference
+                in_stream.vtable.Release(in_stream)
+            else:
+                log.debug('no seekable stream for item %d, spooling it', self.index)
+                spool = SpooledTemporaryFile(spool_size)
+                self.extract(spool)
+                spool.seek(0)
+                stream = FileInStream(spool, stats, close_file=True)
+            archive = Archive(name, in_stream=stream, forcetype=forcetype, password=password, stats=stats)
+        if in_stream is not None:
+            # reading the inner archive moves the outer one's input stream
+            archive.lock = self.archive.lock
+        archive.parent = self.archive
+        return archive
 
     @property
-    def contents(self):
-        #import pdb; pdb.set_trace()
-        if self._contents is None:
-            stream = io.BytesIO()
-            self.extract(stream)
-            self._contents = stream.getvalue()
-
-        return self._contents
-
-    def __getattr__(self, attr):
-        propid = getattr(py7ziptypes.ArchiveProps, attr)
-        return get_prop_val(partial(self.archive.itm_prop_fn, self.index, propid))
+    def contents(self) -> bytes:
+        """whole contents of the item, through the archive's member cache (see Archive.read_cached)"""
+        return self.archive.read_cached(self.index, self.password)
 
     def iter_props(self) -> Iterator[tuple[Optional[str], ArchiveProps, VARTYPE, Any]]:
+        handler = self.archive.archive
         for name, prop, vt in self.archive.iter_props_info():
-            val = get_prop_val(partial(self.archive.itm_prop_fn, self.index, prop))
+            val = read_prop(handler.vtable.GetProperty, handler, self.index, prop)
             yield name, prop, vt, val
 
     def get_seq_in_stream(self) -> Optional[Any]:
+        """
+        ISequentialInStream* over the item from the handler's IInArchiveGetStream, None if it doesn't have one.
+        The caller owns a reference to it and must Release it.
+        """
         get_void_ptr = ffi.new('void**')
         archive = self.archive.archive
         res = archive.vtable.QueryInterface(
@@ -371,22 +1038,30 @@ class ArchiveItem():
         get_stream = ffi.cast('IInArchiveGetStream*', get_void_ptr[0])
         get_void_ptr[0] = ffi.NULL
         get_sub_seq_stream_ptr = ffi.new('ISequentialInStream**')
-        res = get_stream.vtable.GetStream(get_stream, self.index, get_sub_seq_stream_ptr)
+        try:
+            with self.archive.lock:
+                res = get_stream.vtable.GetStream(get_stream, self.index, get_sub_seq_stream_ptr)
+        finally:
+            get_stream.vtable.Release(get_stream)
         if res != HRESULT.S_OK.value or get_sub_seq_stream_ptr[0] == ffi.NULL:
             return None
-        sub_seq_stream = ffi.cast('ISequentialInStream*', get_sub_seq_stream_ptr[0])
-        sub_seq_stream.vtable.AddRef(sub_seq_stream)
-        return sub_seq_stream
+        # GetStream already handed us a reference
+        return ffi.cast('ISequentialInStream*', get_sub_seq_stream_ptr[0])
 
     def get_in_stream(self) -> Optional[Any]:
+        """
+        seekable IInStream* over the item, None if the handler has none (compressed or solid items...).
+        The caller owns a reference to it and must Release it.
+        """
         get_void_ptr = ffi.new('void**')
         seq_in_stream = self.get_seq_in_stream()
         if seq_in_stream is None:
             return None
         res = seq_in_stream.vtable.QueryInterface(
             seq_in_stream, uuid2guidp(py7ziptypes.IID_IInStream), get_void_ptr)
+        # QueryInterface took a reference of its own when it succeeded
+        seq_in_stream.vtable.Release(seq_in_stream)
         if res != HRESULT.S_OK.value or get_void_ptr[0] == ffi.NULL:
-            seq_in_stream.vtable.Release(seq_in_stream)
             return None
         in_stream = ffi.cast('IInStream*', get_void_ptr[0])
         return in_stream
@@ -0,0 +1,89 @@
+"""
+Operations over many archives at once, spread across processes or threads
+"""
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import os
+from typing import Iterable, List
+
+from .py7ziptypes import OperationResult
+
+
+class ArchiveTestReport(namedtuple('ArchiveTestReport', ('path', 'results', 'error'))):
+    """
+    results of Archive.test() for the archive at path,
+    or error describing why it couldn't be opened or tested (results is None then)
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and all(result.result == OperationResult.kOK for result in self.results)
+
+
+def _test_worker(path, password) -> ArchiveTestReport:
+    from .archive import Archive
+
+    try:
+        with Archive(path, password=password) as archive:
+            return ArchiveTestReport(path, archive.test(), None)
+    except Exception as ex:
+        # the exception itself may not survive pickling back to the parent
+        return ArchiveTestReport(path, None, '{}: {}'.format(type(ex).__name__, ex))
+
+
+def test_many(paths: Iterable[os.PathLike], workers: int=None, password: str=None) -> List[ArchiveTestReport]:
+    """
+    test every archive in paths with Archive.test(), one archive at a time per worker process
+    (os.cpu_count() of them by default). Reports come back in the order of paths.
+    """
+    paths = [os.fspath(path) for path in paths]
+    with ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(_test_worker, paths, [password] * len(paths)))
+
+
+#: one archive for extract_archives(): extract the archive at path into directory
+ExtractJob = namedtuple('ExtractJob', ('path', 'directory', 'password'), defaults=(None,))
+
+
+class ExtractReport(namedtuple('ExtractReport', ('path', 'result', 'error'))):
+    """
+    what Archive.extract() returned for the archive at path (True, or the digests with hashes),
+    or the exception that stopped it (result is None then)
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.result is not False
+
+
+def _extract_job(job: ExtractJob, hashes, write_behind) -> ExtractReport:
+    from .archive import Archive
+
+    try:
+        with Archive(job.path, password=job.password) as archive:
+            result = archive.extract(job.directory, hashes=hashes, write_behind=write_behind)
+        return ExtractReport(job.path, result, None)
+    except Exception as ex:
+        return ExtractReport(job.path, None, ex)
+
+
+def extract_archives(jobs: Iterable, workers: int=None, hashes=None, write_behind=None) -> List[ExtractReport]:
+    """
+    extract many archives concurrently, each job being an ExtractJob or a (path, directory[, password]) tuple.
+
+    Each archive is opened and extracted whole on one of workers threads (os.cpu_count() by default):
+    7-Zip decodes without holding the GIL, so threads scale across archives like processes do without
+    their memory and start-up costs. hashes and write_behind are passed on to Archive.extract(),
+    a writebehind.WriteBehind can be shared by all the jobs: each job waits for its own writes only and
+    fails with its own errors only (see writebehind.WriteGroup). Reports come back in the order of jobs.
+    """
+    jobs = [job if isinstance(job, ExtractJob) else ExtractJob(*job) for job in jobs]
+    with ThreadPoolExecutor(workers or os.cpu_count()) as executor:
+        return list(executor.map(partial(_extract_job, hashes=hashes, write_behind=write_behind), jobs))
+
+
+# not a test function, for pytest
+test_many.__test__ = False
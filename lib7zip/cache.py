@@ -0,0 +1,82 @@
+"""
+Cache of decoded archive members, bounded in bytes
+"""
+from collections import OrderedDict
+import threading
+from typing import Optional
+
+#: bytes of decoded members an archive keeps by default
+DEFAULT_CACHE_SIZE = 64 << 20
+#: members of a solid block decoded on the way to the one asked for are kept up to this size
+DEFAULT_MAX_SIBLING_SIZE = 1 << 20
+
+
+class MemberCache:
+    """
+    Contents of archive members by index, least recently used dropped first once they add up to more than max_bytes.
+
+    Members larger than max_bytes // 4 are never kept, nor are siblings (members decoded on the way to another,
+    see Archive.read_cached) larger than max_sibling_size. Siblings captured by one read take at most half the cache,
+    so they can't push out everything else.
+    """
+    def __init__(self, max_bytes: int=DEFAULT_CACHE_SIZE, max_sibling_size: int=DEFAULT_MAX_SIBLING_SIZE):
+        self.max_bytes = max_bytes
+        self.max_sibling_size = max_sibling_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        #: members kept without having been asked for
+        self.captured = 0
+        self._members = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_item_size(self) -> int:
+        return self.max_bytes // 4
+
+    @property
+    def max_siblings_size(self) -> int:
+        """bytes of siblings one read may add"""
+        return self.max_bytes // 2
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def __contains__(self, index: int) -> bool:
+        return index in self._members
+
+    def get(self, index: int) -> Optional[bytes]:
+        with self._lock:
+            try:
+                self._members.move_to_end(index)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self._members[index]
+
+    def admits(self, size: int, sibling: bool=False) -> bool:
+        """whether a member of size bytes would be kept"""
+        return 0 <= size <= (min(self.max_sibling_size, self.max_item_size) if sibling else self.max_item_size)
+
+    def put(self, index: int, data: bytes, sibling: bool=False) -> bool:
+        """keep data as the contents of member index if admitted, True if it was"""
+        if not self.admits(len(data), sibling):
+            return False
+        with self._lock:
+            old = self._members.pop(index, None)
+            if old is not None:
+                self.size -= len(old)
+            self._members[index] = data
+            self.size += len(data)
+            if sibling:
+                self.captured += 1
+            while self.size > self.max_bytes:
+                _, evicted = self._members.popitem(last=False)
+                self.size -= len(evicted)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._members.clear()
+            self.size = 0
@@ -3,7 +3,7 @@ log = logging.getLogger(__name__)
 
 from .py7ziptypes import IID_ICompressCodecsInfo
 from .simplecom import IUnknownImpl
-from . import ffi, methods, dll7z
+from . import ffi, load_dll, load_tables
 from .wintypes import HRESULT
 from .winhelpers import uuid2guidp
 
@@ -15,18 +15,18 @@ class CompressCodecsInfo(IUnknownImpl):
 
     def GetNumberOfMethods(self, me, numMethods):
         log.debug('Info.GetNumberOfMethods')
-        return dll7z.GetNumberOfMethods(numMethods)
+        return load_dll().GetNumberOfMethods(numMethods)
 
     def GetProperty(self, me, index, propID, value):
         log.debug('Info.GetProperty')
-        return dll7z.GetMethodProperty(index, propID, value)
+        return load_dll().GetMethodProperty(index, propID, value)
 
     def CreateDecoder(self, me, index, iid, coder):
         log.debug('Info.CreateDecoder')
-        classid = uuid2guidp(methods[index].decoder)
-        return dll7z.CreateObject(classid, iid, coder)
+        classid = uuid2guidp(load_tables().methods[index].decoder)
+        return load_dll().CreateObject(classid, iid, coder)
 
     def CreateEncoder(self, me, index, iid, coder):
         log.debug('Info.CreateEncoder')
-        classid = uuid2guidp(methods[index].encoder)
-        return dll7z.CreateObject(classid, iid, coder)
+        classid = uuid2guidp(load_tables().methods[index].encoder)
+        return load_dll().CreateObject(classid, iid, coder)
@@ -1,4 +1,4 @@
-import os, os.path
+from functools import partial
 
 from .py7ziptypes import IID_ICryptoGetTextPassword, IID_IArchiveExtractCallback, \
     IID_ISequentialOutStream, IID_ICompressProgressInfo, IID_ICryptoGetTextPassword2, \
@@ -7,7 +7,9 @@ from .py7ziptypes import IID_ICryptoGetTextPassword, IID_IArchiveExtractCallback
 from .wintypes import HRESULT
 from . import log, ffi, C, py7ziptypes, alloc_string
 from .simplecom import IUnknownImpl
-from .stream import FileOutStream
+from .stream import FileOutStream, BufferOutStream, CallableWriter
+from .plan import ExtractionPlan
+from .writebehind import DeferredFile
 
 class ArchiveExtractCallback(IUnknownImpl):
     """
@@ -20,10 +22,18 @@ class ArchiveExtractCallback(IUnknownImpl):
         IID_ICompressProgressInfo: 'ICompressProgressInfo',
     }
 
-    def __init__(self, password=''):
+    def __init__(self, password='', stats=None, hashes=()):
         #self.out_file = FileOutStream(file)
         #self.password = ffi.new('char[]', (password or '').encode('ascii'))
         self.res = None
+        #: OperationResult of every item extracted so far, by index
+        self.results = {}
+        #: index of the item being extracted, set by GetStream
+        self.current_index = None
+        #: hashlib algorithms computed over every item written out
+        self.hashes = tuple(hashes or ())
+        #: {algorithm: hex digest} of every item written out so far, by index, when hashes were asked for
+        self.digests = {}
         self.password = password or ''
         #password = password or ''
         '''
@@ -33,20 +43,27 @@ class ArchiveExtractCallback(IUnknownImpl):
         self.password[len(password)] = '\0'
         '''
 
-        super().__init__()
+        super().__init__(stats)
 
     def cleanup(self, res: OperationResult):
         pass
 
+    def new_out_stream(self, file) -> FileOutStream:
+        return FileOutStream(file, self.stats, self.hashes)
+
+    def record_digests(self, stream: FileOutStream):
+        if self.hashes and self.current_index is not None:
+            self.digests[self.current_index] = stream.hexdigests()
+
     #HRESULT(*SetTotal)(void* self, uint64_t total);
     def SetTotal(self, me, total):
-        log.info('SetTotal %d' % total)
+        log.info('SetTotal %d', total)
         return HRESULT.S_OK.value
 
     #HRESULT(*SetCompleted)(void* self, const uint64_t *completeValue);
     def SetCompleted(self, me, completeValue):
         if completeValue:
-            log.info('SetCompleted: %d' % int(completeValue[0]))
+            log.info('SetCompleted: %d', completeValue[0])
         else:
             log.info('SetCompleted: NULL')
         return HRESULT.S_OK.value
@@ -58,7 +75,7 @@ class ArchiveExtractCallback(IUnknownImpl):
 
     #HRESULT(*PrepareOperation)(void* self, int32_t askExtractMode);
     def PrepareOperation(self, me, askExtractMode):
-        log.info('PrepareOperation, askExtractMode=%d' % int(askExtractMode))
+        log.info('PrepareOperation, askExtractMode=%d', askExtractMode)
         return HRESULT.S_OK.value
 
     #HRESULT(*SetOperationResult)(void* self, int32_t resultEOperationResult);
@@ -69,8 +86,11 @@ class ArchiveExtractCallback(IUnknownImpl):
         else:
             log.warning('Operational Result: %s', res.name)
         self.res = res
+        if self.current_index is not None:
+            self.results[self.current_index] = res
 
         self.cleanup(res)
+        self.current_index = None
         return HRESULT.S_OK.value
 
     def CryptoGetTextPassword(self, me, password):
@@ -93,40 +113,59 @@ class ArchiveExtractCallback(IUnknownImpl):
 
     #STDMETHOD(SetRatioInfo)(const UInt64 *inSize, const UInt64 *outSize) PURE;
     def SetRatioInfo(self, me, in_size, out_size):
-        log.debug('SetRatioInfo: in_size=%d, out_size=%d' % (int(in_size[0]), int(out_size[0])))
+        log.debug('SetRatioInfo: in_size=%d, out_size=%d', in_size[0], out_size[0])
         return HRESULT.S_OK.value
 
 
 class ArchiveExtractToDirectoryCallback(ArchiveExtractCallback):
     """
-            each item is extracted to the given directory based on it's path.
+            each item is extracted to the given directory based on it's path,
+            or only the items in indices if given.
+            Paths, sizes and metadata all come from an ExtractionPlan worked out before extraction starts,
+            call plan.apply_metadata() once it's done.
+            With writer (a writebehind.WriteBehind) files are written from its threads as one write_group,
+            writer.drain(write_group) before that.
     """
-    def __init__(self, archive, directory='', password=''):
+    def __init__(self, archive, directory='', password='', stats=None, hashes=(), indices=None, plan=None,
+                 writer=None):
         self.directory = directory
         self.archive = archive
+        self.writer = writer
+        self.write_group = writer.group() if writer is not None else None
+        self.plan = plan if plan is not None else ExtractionPlan(archive, directory, indices)
+        self._dirs_made = False
         self._streams = []
         #self._cleaned_up = False
-        super().__init__(password)
+        super().__init__(password, stats, hashes)
 
     def GetStream(self, me, index, outStream, askExtractMode):
         askExtractMode = AskMode(askExtractMode)
         log.debug('GetStream(%d, -, %r)', index, askExtractMode)
 
-        if askExtractMode != AskMode.kExtract:
+        if askExtractMode != AskMode.kExtract or index not in self.plan:
+            outStream[0] = ffi.NULL
             return HRESULT.S_OK.value
 
+        if not self._dirs_made:
+            self.plan.make_dirs()
+            self._dirs_made = True
 
-        path = os.path.join(self.directory, self.archive[index].path)
-        dirname = os.path.dirname(path)
+        self.current_index = index
+        path = self.plan.targets[index]
         log.debug('extracting to: %s', path)
 
-        if self.archive[index].is_dir:
-            os.makedirs(path, exist_ok=True)
+        if index in self.plan.dirs:
+            self.plan.dir_done(index)
             outStream[0] = ffi.NULL
+        elif self.writer is not None:
+            stream = self.new_out_stream(DeferredFile(
+                self.writer, index, path, partial(self.plan.open_file, index), self.write_group))
+            self._streams.append((index, stream))
+            outStream[0] = stream.instances[IID_ISequentialOutStream]
         else:
-            os.makedirs(dirname, exist_ok=True)
-            stream = FileOutStream(path)
-            self._streams.append(stream)
+            stream = self.new_out_stream(path)
+            self.plan.open_file(index, stream.fd)
+            self._streams.append((index, stream))
             outStream[0] = stream.instances[IID_ISequentialOutStream]
         return HRESULT.S_OK.value
 
@@ -135,10 +174,15 @@ class ArchiveExtractToDirectoryCallback(ArchiveExtractCallback):
         #if self._cleaned_up:
         #	return
 
-        for stream in self._streams:
+        for index, stream in self._streams:
             #TODO? stream.Release()
-            stream.filelike.flush()
-            stream.filelike.close()
+            stream.flush()
+            if self.writer is not None:
+                stream.filelike.close(partial(self.plan.file_done, index, apply_now=True))
+            else:
+                self.plan.file_done(index, stream.fd)
+            stream.close()
+            self.record_digests(stream)
 
         self._streams = []
         self._cleaned_up = True
@@ -146,12 +190,13 @@ class ArchiveExtractToDirectoryCallback(ArchiveExtractCallback):
 
 class ArchiveExtractToStreamCallback(ArchiveExtractCallback):
     """
-            Extract all files to the same stream (most useful for extracting one file)
+            Extract all files to the same stream (most useful for extracting one file),
+            a path, a file-like object or a BufferOutStream
     """
-    def __init__(self, stream, index, password=''):
+    def __init__(self, stream, index, password='', stats=None, hashes=()):
         self.index = index
-        self.stream = FileOutStream(stream)
-        super().__init__(password)
+        self.stream = stream if isinstance(stream, BufferOutStream) else FileOutStream(stream, stats, hashes)
+        super().__init__(password, stats, hashes)
 
     def GetStream(self, me, index, outStream, askExtractMode):
         askExtractMode = AskMode(askExtractMode)
@@ -161,9 +206,65 @@ class ArchiveExtractToStreamCallback(ArchiveExtractCallback):
             return HRESULT.S_OK.value
 
         if self.index == index:
+            self.current_index = index
             outStream[0] = self.stream.instances[py7ziptypes.IID_ISequentialOutStream]
             return HRESULT.S_OK.value
         else:
             log.debug('index not found')
             outStream[0] = ffi.NULL
             return HRESULT.S_OK.value
+
+    def cleanup(self, res: OperationResult):
+        self.stream.flush()
+        self.record_digests(self.stream)
+
+
+class ArchiveExtractToSinksCallback(ArchiveExtractCallback):
+    """
+            each item is routed to its own sink: a path, a writable file-like object or a callable
+            receiving every chunk. Sinks given as paths are only opened once 7-Zip reaches the item.
+    """
+    def __init__(self, sinks, password='', stats=None, hashes=()):
+        self.sinks = sinks
+        self.stream = None
+        super().__init__(password, stats, hashes)
+
+    def GetStream(self, me, index, outStream, askExtractMode):
+        askExtractMode = AskMode(askExtractMode)
+        log.debug('GetStream(%d, -, %r)', index, askExtractMode)
+
+        if askExtractMode != AskMode.kExtract:
+            return HRESULT.S_OK.value
+
+        self.current_index = index
+        sink = self.sinks.get(index)
+        if sink is None:
+            outStream[0] = ffi.NULL
+            return HRESULT.S_OK.value
+
+        if callable(sink) and not hasattr(sink, 'write'):
+            sink = CallableWriter(sink)
+        self.stream = self.new_out_stream(sink)
+        outStream[0] = self.stream.instances[IID_ISequentialOutStream]
+        return HRESULT.S_OK.value
+
+    def cleanup(self, res: OperationResult):
+        if self.stream is not None:
+            self.stream.close()
+            self.record_digests(self.stream)
+            self.stream = None
+
+
+class ArchiveTestCallback(ArchiveExtractCallback):
+    """
+            for test mode: 7-Zip decodes every item and checks it without writing it anywhere,
+            only the OperationResult of each item is kept
+    """
+    def GetStream(self, me, index, outStream, askExtractMode):
+        askExtractMode = AskMode(askExtractMode)
+        log.debug('GetStream(%d, -, %r)', index, askExtractMode)
+
+        outStream[0] = ffi.NULL
+        if askExtractMode == AskMode.kTest:
+            self.current_index = index
+        return HRESULT.S_OK.value
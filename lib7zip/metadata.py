@@ -0,0 +1,127 @@
+"""
+Columnar bulk reads of item properties, for listing whole archives without an ArchiveItem per entry
+"""
+from array import array
+
+from . import ffi, free_propvariant
+from .py7ziptypes import ArchiveProps
+from .wintypes import VARTYPE
+from .winhelpers import scratch_propvariant, read_prop, RNOK
+
+#: stored in numeric columns when an item doesn't have the property
+MISSING = -1
+
+DEFAULT_PROPS = ('path', 'size', 'pack_size', 'crc', 'mtime', 'is_dir')
+
+# column kinds
+STRING, INTEGER, BOOLEAN, FILETIME, OTHER = range(5)
+
+# not every handler lists these in GetPropertyInfo (7z never lists is_dir)
+WELL_KNOWN_VARTYPES = {
+    ArchiveProps.path: VARTYPE.VT_BSTR,
+    ArchiveProps.name: VARTYPE.VT_BSTR,
+    ArchiveProps.method: VARTYPE.VT_BSTR,
+    ArchiveProps.is_dir: VARTYPE.VT_BOOL,
+    ArchiveProps.encrypted: VARTYPE.VT_BOOL,
+    ArchiveProps.size: VARTYPE.VT_UI8,
+    ArchiveProps.pack_size: VARTYPE.VT_UI8,
+    ArchiveProps.crc: VARTYPE.VT_UI4,
+    ArchiveProps.attrib: VARTYPE.VT_UI4,
+    ArchiveProps.block: VARTYPE.VT_UI4,
+    ArchiveProps.ctime: VARTYPE.VT_FILETIME,
+    ArchiveProps.atime: VARTYPE.VT_FILETIME,
+    ArchiveProps.mtime: VARTYPE.VT_FILETIME,
+}
+
+INTEGER_FIELDS = {
+    VARTYPE.VT_UI1: 'bVal',
+    VARTYPE.VT_UI2: 'uiVal',
+    VARTYPE.VT_I2: 'iVal',
+    VARTYPE.VT_UI4: 'ulVal',
+    VARTYPE.VT_UINT: 'ulVal',
+    VARTYPE.VT_I4: 'lVal',
+    VARTYPE.VT_UI8: 'uhVal',
+    VARTYPE.VT_I8: 'hVal',
+}
+
+
+def column_kind(vt: VARTYPE) -> int:
+    if vt == VARTYPE.VT_BSTR:
+        return STRING
+    elif vt == VARTYPE.VT_BOOL:
+        return BOOLEAN
+    elif vt == VARTYPE.VT_FILETIME:
+        return FILETIME
+    elif vt in INTEGER_FIELDS:
+        return INTEGER
+    return OTHER
+
+
+def new_column(kind: int):
+    if kind == BOOLEAN:
+        return array('b')
+    elif kind in (INTEGER, FILETIME):
+        return array('q')
+    return []
+
+
+def read_columns(archive, num_items: int, props, vartypes) -> dict:
+    """
+    read every prop in props for items 0..num_items-1 of archive (an IInArchive*)
+    into one column per prop, reusing this thread's scratch PROPVARIANT throughout.
+
+    vartypes maps ArchiveProps to the VARTYPE the handler reports for it.
+    Strings (and properties of unusual types) end up in lists with None for missing values,
+    numbers in array('q')/array('b') with MISSING, times as raw FILETIME ticks.
+    """
+    get_property = archive.vtable.GetProperty
+    pvar = scratch_propvariant()
+
+    readers = []
+    columns = {}
+    for prop in props:
+        prop = ArchiveProps[prop] if isinstance(prop, str) else ArchiveProps(prop)
+        vt = vartypes.get(prop, WELL_KNOWN_VARTYPES.get(prop))
+        kind = column_kind(vt) if vt is not None else OTHER
+        columns[prop.name] = column = new_column(kind)
+        readers.append((int(prop), kind, column))
+
+    vt_bstr, vt_bool, vt_filetime = VARTYPE.VT_BSTR, VARTYPE.VT_BOOL, VARTYPE.VT_FILETIME
+    try:
+        for index in range(num_items):
+            for propid, kind, column in readers:
+                if kind == OTHER:
+                    column.append(read_prop(get_property, archive, index, propid))
+                    continue
+
+                RNOK(get_property(archive, index, propid, pvar))
+                vt = pvar.vt
+                if kind == STRING:
+                    column.append(ffi.string(pvar.bstrVal) if vt == vt_bstr and pvar.bstrVal != ffi.NULL else None)
+                elif kind == INTEGER and vt in INTEGER_FIELDS:
+                    column.append(getattr(pvar, INTEGER_FIELDS[vt]))
+                elif kind == BOOLEAN and vt == vt_bool:
+                    column.append(1 if pvar.bVal else 0)
+                elif kind == FILETIME and vt == vt_filetime:
+                    column.append((pvar.filetime.dwHighDateTime << 32) | pvar.filetime.dwLowDateTime)
+                else:
+                    # VT_EMPTY, or a handler disagreeing with itself about the type
+                    column.append(MISSING)
+                if vt == vt_bstr:
+                    free_propvariant(pvar)
+    finally:
+        # in case a read failed with a string still in it
+        free_propvariant(pvar)
+
+    return columns
+
+
+def columns_to_numpy(columns: dict) -> dict:
+    """view every array column as a numpy array without copying, lists are left alone"""
+    import numpy
+
+    return {
+        name: numpy.frombuffer(column, dtype=numpy.int64 if column.typecode == 'q' else numpy.int8)
+        if isinstance(column, array) else column
+        for name, column in columns.items()
+    }
@@ -1,12 +1,20 @@
+import os
+
 from .comtypes import IID_IUnknown
-from .py7ziptypes import IID_ICryptoGetTextPassword, IID_IArchiveOpenCallback, IID_IArchiveOpenVolumeCallback, IID_IArchiveOpenSetSubArchiveName
+from .py7ziptypes import IID_ICryptoGetTextPassword, IID_IArchiveOpenCallback, IID_IArchiveOpenVolumeCallback, \
+    IID_IArchiveOpenSetSubArchiveName, IID_IInStream, ArchiveProps
 from .simplecom import IUnknownImpl
+from .volumes import VolumeInStream
 
 from .wintypes import HRESULT
 from .winhelpers import guidp2uuid
-from . import log, ffi, wintypes
+from . import log, ffi, wintypes, alloc_string
 
 class ArchiveOpenCallback(IUnknownImpl):
+    """
+            volume_path: path of the (first) volume being opened, multi-volume handlers (rar, zip, ...)
+            derive the names of the other volumes from it and get them from GetStream, read through pool.
+    """
     GUIDS = {
         IID_ICryptoGetTextPassword: 'ICryptoGetTextPassword',
         IID_IArchiveOpenCallback: 'IArchiveOpenCallback',
@@ -14,16 +22,17 @@ class ArchiveOpenCallback(IUnknownImpl):
         IID_IArchiveOpenSetSubArchiveName: 'IArchiveOpenSetSubArchiveName',
     }
 
-    def __init__(self, password=None, stream=None):
-        if password is None:
-            password = ''
-
-            self.password = ffi.new('wchar_t[]', password)
+    def __init__(self, password=None, stream=None, stats=None, volume_path=None, pool=None):
+        self.password = password or ''
 
         self.stream = stream
         self.subarchive_name = None
+        self.volume_path = None if volume_path is None else os.fspath(volume_path)
+        self.pool = pool
+        #: streams handed out for the other volumes, 7-Zip keeps using them after Open
+        self.volumes = {}
 
-        super().__init__()
+        super().__init__(stats)
 
     def SetTotal(self, me, files, bytes):
         log.debug('on_set_total')
@@ -35,20 +44,37 @@ class ArchiveOpenCallback(IUnknownImpl):
 
     def CryptoGetTextPassword(self, me, password):
         log.debug('GetPassword')
-        password[0] = self.password
+        # 7-Zip frees the string
+        password[0] = alloc_string(self.password)
         return HRESULT.S_OK.value
 
     def GetProperty(self, me, propID, value):
-        log.debug('GetProperty propID={}'.format(propID))
-        value.vt = wintypes.VARTYPE.VT_EMPTY
+        log.debug('GetProperty propID=%d', propID)
+        if propID == ArchiveProps.name and self.volume_path is not None:
+            value.vt = wintypes.VARTYPE.VT_BSTR
+            value.bstrVal = alloc_string(os.path.basename(self.volume_path))
+        else:
+            value.vt = wintypes.VARTYPE.VT_EMPTY
         return HRESULT.S_OK.value
 
     def GetStream(self, me, name, inStream):
-        log.debug('GetStream name={}'.format(name))
-        return HRESULT.E_NOTIMPL.value
+        name = ffi.string(name)
+        log.debug('GetStream name=%r', name)
+        if self.volume_path is None or self.pool is None:
+            return HRESULT.E_NOTIMPL.value
+        path = os.path.join(os.path.dirname(self.volume_path), name)
+        if not os.path.isfile(path):
+            # no more volumes
+            return HRESULT.S_FALSE.value
+        stream = self.volumes.get(path)
+        if stream is None:
+            stream = self.volumes[path] = VolumeInStream(self.pool, [path], self.stats)
+        stream.pos = 0
+        inStream[0] = stream.instances[IID_IInStream]
+        return HRESULT.S_OK.value
 
     def SetSubArchiveName(self, me, name):
-        log.debug('SetSubArchiveName: {}'.format(name))
+        log.debug('SetSubArchiveName: %r', name)
         #name = ffi.string(name)
         # self.subarchive_name = name
         return HRESULT.E_NOTIMPL.value
@@ -0,0 +1,110 @@
+"""
+Hashed index of item paths and the directory tree they form, answering lookups without going back to 7-Zip
+"""
+import os
+import re
+from typing import Iterable, List, Optional
+
+
+def normpath(path: str) -> str:
+    """item path -> key used in the index: '/' separated, no leading or trailing separator"""
+    if os.sep != '/':
+        path = path.replace(os.sep, '/')
+    return path.strip('/')
+
+
+def translate_glob(pattern: str) -> str:
+    """
+    glob pattern -> regular expression over normalized paths.
+
+    * and ? don't match across '/', [...] is a character class and a ** component matches any number of directories.
+    """
+    parts = normpath(pattern).split('/')
+    regex = []
+    for i, part in enumerate(parts):
+        if part == '**':
+            regex.append('.*' if i == len(parts) - 1 else '(?:[^/]*/)*')
+            continue
+        j = 0
+        while j < len(part):
+            c = part[j]
+            if c == '*':
+                regex.append('[^/]*')
+            elif c == '?':
+                regex.append('[^/]')
+            elif c == '[' and part.find(']', j + 2) != -1:
+                end = part.find(']', j + 2)
+                chars = part[j + 1:end].replace('\\', '\\\\')
+                if chars.startswith('!'):
+                    chars = '^' + chars[1:]
+                regex.append('[' + chars + ']')
+                j = end
+            else:
+                regex.append(re.escape(c))
+            j += 1
+        if i != len(parts) - 1:
+            regex.append('/')
+    return '(?s:' + ''.join(regex) + r')\Z'
+
+
+class PathIndex:
+    """
+    Exact lookup of items by path, plus the directory tree of the archive including directories that
+    only exist implicitly as the parent of some item.
+    """
+    def __init__(self, paths: Iterable[Optional[str]], is_dir: Iterable[bool]):
+        self.paths = []
+        self.path2idx = {}
+        # directory key -> names of its direct children, '' is the root
+        self.children = {'': set()}
+
+        for index, (path, isdir) in enumerate(zip(paths, is_dir)):
+            self.paths.append(path)
+            if path is None:
+                continue
+            key = normpath(path)
+            # like extraction, the last of several items with the same path wins
+            self.path2idx[key] = index
+            self._add(key)
+            if isdir:
+                self.children.setdefault(key, set())
+
+    def _add(self, key: str):
+        while key:
+            parent, _, name = key.rpartition('/')
+            siblings = self.children.get(parent)
+            if siblings is not None:
+                siblings.add(name)
+                return
+            self.children[parent] = {name}
+            key = parent
+
+    def lookup(self, path: str) -> int:
+        """index of the item at path, raises KeyError"""
+        return self.path2idx[normpath(path)]
+
+    def exists(self, path: str) -> bool:
+        key = normpath(path)
+        return key in self.path2idx or key in self.children
+
+    def isdir(self, path: str) -> bool:
+        return normpath(path) in self.children
+
+    def listdir(self, path: str='') -> List[str]:
+        """sorted names of the direct children of directory path"""
+        key = normpath(path)
+        try:
+            return sorted(self.children[key])
+        except KeyError:
+            if key in self.path2idx:
+                raise NotADirectoryError(path) from None
+            raise FileNotFoundError(path) from None
+
+    def match(self, pattern: str) -> List[int]:
+        """indices of the items whose path matches the glob pattern, in archive order"""
+        matches = re.compile(translate_glob(pattern)).match
+        return sorted(index for key, index in self.path2idx.items() if matches(key))
+
+    def glob(self, pattern: str) -> List[str]:
+        """paths of the items matching the glob pattern, as the archive reports them"""
+        return [self.paths[index] for index in self.match(pattern)]
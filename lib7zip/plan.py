@@ -0,0 +1,146 @@
+"""
+Everything extraction to a directory needs to know about the items, worked out before 7-Zip starts decoding
+"""
+import os
+import stat
+from typing import Iterable, Optional
+
+from . import log
+from .metadata import MISSING
+
+#: files at least this large are preallocated before being written, smaller ones aren't worth the syscall
+PREALLOCATE_MIN_SIZE = 1 << 20
+
+# FILETIME ticks (100ns since 1601) of the unix epoch
+EPOCH_TICKS = 116444736000000000
+FILE_ATTRIBUTE_READONLY = 0x1
+# set by p7zip and 7-Zip when the high 16 bits of attrib hold a unix st_mode
+FILE_ATTRIBUTE_UNIX_EXTENSION = 0x8000
+
+
+def safe_relpath(path: str) -> str:
+    """item path -> path relative to the extraction directory, without any way out of it"""
+    if os.sep != '/':
+        path = path.replace(os.sep, '/')
+    parts = [part for part in path.split('/') if part not in ('', '.', '..')]
+    return os.path.join(*parts) if parts else ''
+
+
+class ExtractionPlan:
+    """
+    Target path, size and metadata of every item to extract, read with one metadata() pass.
+
+    make_dirs() creates the whole directory tree up front, each directory once, open_file() preallocates files
+    from their size, file_done() trims them should fewer bytes arrive, and apply_metadata() sets times and
+    permissions of everything extracted in one go at the end (directories last, writing files changes their mtime).
+    """
+    def __init__(self, archive, directory='', indices: Optional[Iterable[int]]=None,
+                 preallocate: bool=True, times: bool=True, attrib: bool=True):
+        self.directory = directory
+        self.preallocate = preallocate and hasattr(os, 'posix_fallocate')
+        self.times = times
+        self.attrib = attrib
+        columns = archive.metadata(('path', 'is_dir', 'size', 'mtime', 'attrib'))
+        self.sizes = columns['size']
+        self.mtimes = columns['mtime']
+        self.attribs = columns['attrib']
+
+        # items without a path (e.g. the contents of a .gz) are named after the archive, like 7-Zip does
+        default_name = archive.filename.stem or 'data'
+        if indices is None:
+            indices = range(len(columns['path']))
+        #: index -> target path of every item to extract
+        self.targets = {}
+        #: indices of the directories among them
+        self.dirs = set()
+        #: every directory that has to exist, including parents of files
+        self.tree = set()
+        for index in indices:
+            path = columns['path'][index]
+            target = os.path.join(directory, safe_relpath(default_name if path is None else path))
+            self.targets[index] = target
+            if columns['is_dir'][index] == 1:
+                self.dirs.add(index)
+                self.tree.add(target)
+            else:
+                self.tree.add(os.path.dirname(target))
+        self.created = set()
+        self.done = []
+
+    def __contains__(self, index: int) -> bool:
+        return index in self.targets
+
+    @property
+    def indices(self) -> list[int]:
+        return sorted(self.targets)
+
+    def make_dirs(self):
+        """create every directory the plan needs, skipping any already created"""
+        for path in sorted(self.tree):
+            if path in self.created:
+                continue
+            os.makedirs(path or '.', exist_ok=True)
+            # makedirs went through all the parents as well
+            while path and path not in self.created:
+                self.created.add(path)
+                path = os.path.dirname(path)
+
+    def open_file(self, index: int, fd: Optional[int]):
+        """file of item index is about to be written through fd: reserve its space"""
+        size = self.sizes[index]
+        if fd is None or not self.preallocate or size < PREALLOCATE_MIN_SIZE:
+            return
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError as ex:
+            # not supported by every file system, it's only an optimization
+            log.debug('posix_fallocate(%r) failed: %r', self.targets[index], ex)
+
+    def file_done(self, index: int, fd: Optional[int], apply_now: bool=False):
+        """
+        file of item index is complete (its writes flushed): cut off whatever was preallocated but not written.
+        Its metadata is applied right away with apply_now, otherwise by the next apply_metadata().
+        """
+        if fd is not None and self.preallocate and self.sizes[index] >= PREALLOCATE_MIN_SIZE:
+            written = os.lseek(fd, 0, os.SEEK_CUR)
+            if written != os.fstat(fd).st_size:
+                os.ftruncate(fd, written)
+        if apply_now:
+            self.apply_item_metadata(index)
+        else:
+            self.done.append(index)
+
+    def dir_done(self, index: int):
+        self.done.append(index)
+
+    def apply_metadata(self):
+        """set mtime and permissions of everything extracted so far"""
+        done = sorted(self.done, key=lambda index: (index in self.dirs, -len(self.targets[index])))
+        self.done = []
+        for index in done:
+            self.apply_item_metadata(index)
+
+    def apply_item_metadata(self, index: int):
+        target = self.targets[index]
+        try:
+            if self.attrib:
+                mode = self.mode(index)
+                if mode is not None:
+                    os.chmod(target, mode)
+            mtime = self.mtimes[index]
+            if self.times and mtime != MISSING:
+                mtime_ns = (mtime - EPOCH_TICKS) * 100
+                os.utime(target, ns=(mtime_ns, mtime_ns))
+        except OSError as ex:
+            log.debug('could not set metadata of %r: %r', target, ex)
+
+    def mode(self, index: int) -> Optional[int]:
+        """permissions to give the extracted item, None to leave the default"""
+        attrib = self.attribs[index]
+        if attrib == MISSING:
+            return None
+        if attrib & FILE_ATTRIBUTE_UNIX_EXTENSION:
+            return stat.S_IMODE(attrib >> 16) or None
+        if os.name == 'nt' and attrib & FILE_ATTRIBUTE_READONLY and index not in self.dirs:
+            return stat.S_IREAD
+        return None
@@ -0,0 +1,208 @@
+"""
+Pool of opened archives, so archives used over and over are only opened (and their headers parsed) once
+"""
+from array import array
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+import os
+import sys
+import threading
+from typing import Iterator
+
+from . import log
+from .archive import Archive
+from .metadata import DEFAULT_PROPS
+
+DEFAULT_MAX_ARCHIVES = 128
+DEFAULT_MAX_BYTES = 256 << 20
+# rough memory held by 7-Zip for an opened archive and for each of its items, which can't be measured
+ARCHIVE_OVERHEAD = 64 << 10
+ITEM_OVERHEAD = 256
+
+# base_size: estimate for the archive and its metadata, size: that plus its member cache when last checked in
+_Entry = namedtuple('_Entry', ('key', 'archive', 'base_size', 'size'))
+
+
+def estimate_size(columns: dict) -> int:
+    """approximate memory used by an opened archive and its metadata columns"""
+    num_items = len(next(iter(columns.values()), ()))
+    size = ARCHIVE_OVERHEAD + num_items * ITEM_OVERHEAD
+    for column in columns.values():
+        if isinstance(column, array):
+            size += column.itemsize * len(column)
+        else:
+            size += sys.getsizeof(column) + sum(sys.getsizeof(value) for value in column)
+    return size
+
+
+class ArchivePool:
+    """
+    Thread-safe LRU cache of opened Archives, keyed on (path, size, mtime) so a file that changes is
+    opened anew and the archives opened before the change are dropped.
+
+    Archives are handed out exclusively, with open(path) as a context manager (or checkout()/checkin()):
+    several threads asking for the same archive at once get an instance each. Idle archives are closed,
+    least recently used first, once more than max_archives are open or their estimated memory use
+    (metadata plus an allowance per item for 7-Zip's own structures, plus their member caches) passes max_bytes.
+
+    open_kwargs are passed on to Archive.
+    """
+    def __init__(self, max_archives: int=DEFAULT_MAX_ARCHIVES, max_bytes: int=DEFAULT_MAX_BYTES, **open_kwargs):
+        self.max_archives = max_archives
+        self.max_bytes = max_bytes
+        self.open_kwargs = open_kwargs
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        # id(archive) -> _Entry, least recently used first
+        self._idle = OrderedDict()
+        self._in_use = {}
+        # real path -> key last seen for it
+        self._current = {}
+        # key -> metadata snapshot shared by every archive open for it
+        self._metadata = {}
+        self._bytes = 0
+
+    @staticmethod
+    def key(path: os.PathLike) -> tuple:
+        real_path = os.path.realpath(path)
+        st = os.stat(real_path)
+        return real_path, st.st_size, st.st_mtime_ns
+
+    def __len__(self) -> int:
+        """number of archives open, idle or in use"""
+        return len(self._idle) + len(self._in_use)
+
+    @property
+    def size(self) -> int:
+        """estimated memory used by the archives open"""
+        return self._bytes
+
+    @contextmanager
+    def open(self, path: os.PathLike) -> Iterator[Archive]:
+        archive = self.checkout(path)
+        try:
+            yield archive
+        finally:
+            self.checkin(archive)
+
+    def checkout(self, path: os.PathLike) -> Archive:
+        """an opened archive for path, to be given back with checkin()"""
+        key = self.key(path)
+        with self._lock:
+            if self._closed:
+                raise ValueError('ArchivePool is closed')
+            stale = self._invalidate(key)
+            entry = None
+            for archive_id, idle in reversed(self._idle.items()):
+                if idle.key == key:
+                    entry = self._idle.pop(archive_id)
+                    self._in_use[archive_id] = entry
+                    self.hits += 1
+                    break
+            else:
+                self.misses += 1
+        self._close_all(stale)
+        if entry is not None:
+            return entry.archive
+
+        archive = Archive(key[0], **self.open_kwargs)
+        try:
+            with self._lock:
+                columns = self._metadata.get(key)
+            if columns is None:
+                columns = archive.metadata(DEFAULT_PROPS)
+            # build the path index now from the same columns, it is kept with the archive
+            archive._build_path_index(columns)
+        except BaseException:
+            archive.close()
+            raise
+        with self._lock:
+            self._metadata.setdefault(key, columns)
+            size = estimate_size(columns)
+            entry = _Entry(key, archive, size, size)
+            self._in_use[id(archive)] = entry
+            self._bytes += entry.size
+            evicted = self._evict()
+        self._close_all(evicted)
+        return archive
+
+    def checkin(self, archive: Archive):
+        """give back an archive from checkout()"""
+        with self._lock:
+            entry = self._in_use.pop(id(archive))
+            # its member cache may have grown meanwhile
+            size = entry.base_size + archive.cache.size
+            self._bytes += size - entry.size
+            entry = entry._replace(size=size)
+            if self._closed or self._current.get(entry.key[0]) != entry.key:
+                self._forget(entry)
+                evicted = [entry]
+            else:
+                self._idle[id(archive)] = entry
+                evicted = self._evict()
+        self._close_all(evicted)
+
+    def metadata(self, path: os.PathLike) -> dict:
+        """
+        Archive.metadata() of the archive at path, as of when it was opened. Shared, don't modify it.
+        """
+        key = self.key(path)
+        with self._lock:
+            columns = self._metadata.get(key)
+        if columns is None:
+            with self.open(path):
+                pass
+            with self._lock:
+                columns = self._metadata[key]
+        return columns
+
+    def _invalidate(self, key) -> list:
+        """record key as current for its path, remove idle archives opened from an older version of the file"""
+        previous = self._current.get(key[0])
+        self._current[key[0]] = key
+        if previous is None or previous == key:
+            return []
+        log.debug('%s changed, dropping the archives open for it', key[0])
+        stale = [entry for entry in self._idle.values() if entry.key == previous]
+        for entry in stale:
+            del self._idle[id(entry.archive)]
+            self._forget(entry)
+        self._metadata.pop(previous, None)
+        return stale
+
+    def _forget(self, entry: _Entry):
+        self._bytes -= entry.size
+        if not any(other.key == entry.key for other in (*self._idle.values(), *self._in_use.values())):
+            self._metadata.pop(entry.key, None)
+
+    def _evict(self) -> list:
+        """remove idle archives, least recently used first, until within the budgets"""
+        evicted = []
+        while self._idle and (len(self) > self.max_archives or self._bytes > self.max_bytes):
+            _, entry = self._idle.popitem(last=False)
+            self._forget(entry)
+            evicted.append(entry)
+        return evicted
+
+    @staticmethod
+    def _close_all(entries):
+        for entry in entries:
+            entry.archive.close()
+
+    def close(self):
+        """close every idle archive, archives still checked out are closed when given back"""
+        with self._lock:
+            self._closed = True
+            idle = list(self._idle.values())
+            self._idle.clear()
+            for entry in idle:
+                self._forget(entry)
+        self._close_all(idle)
+
+    def __enter__(self) -> 'ArchivePool':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
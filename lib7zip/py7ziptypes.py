@@ -152,6 +152,13 @@ class FormatProps(IntEnum):
     kAddExtension = 3
     kUpdate = 4
     kKeepName = 5
+    kSignature = 6
+    kMultiSignature = 7
+    kSignatureOffset = 8
+    kAltStreams = 9
+    kNtSecure = 10
+    kFlags = 11
+    # names of the same ids before 7-Zip 9.3x
     kStartSignature = 6
     kFinishSignature = 7
     kAssociate = 8
@@ -383,6 +390,13 @@ class OperationResult(Enum):
     kUnSupportedMethod = 1
     kDataError = 2
     kCRCError = 3
+    # reported by 7-Zip 9.3x and later
+    kUnavailable = 4
+    kUnexpectedEnd = 5
+    kDataAfterEnd = 6
+    kIsNotArc = 7
+    kHeadersError = 8
+    kWrongPassword = 9
 
 class AskMode(Enum):
     kExtract = 0
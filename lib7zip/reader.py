@@ -0,0 +1,168 @@
+"""
+File-like readers over archive members, decoding on demand instead of buffering whole members
+"""
+import io
+import logging
+import queue
+import threading
+
+from . import ffi
+from .winhelpers import RNOK
+
+log = logging.getLogger(__name__)
+
+#: default number of decoded chunks buffered between the decoder thread and the reader
+QUEUE_SIZE = 8
+
+_EOF = object()
+
+
+class ReaderClosed(Exception):
+    """raised inside the decoder thread to abort extraction once the reader is closed"""
+
+
+class ChunkQueueWriter:
+    """
+            File-like sink copying each chunk 7-Zip writes into a bounded queue,
+            blocking the decoder while the queue is full
+    """
+    def __init__(self, chunks: queue.Queue, closed: threading.Event):
+        self.chunks = chunks
+        self.closed = closed
+
+    def write(self, buf) -> int:
+        if self.closed.is_set():
+            raise ReaderClosed()
+        self.chunks.put(bytes(buf))
+        return len(buf)
+
+
+class MemberReader(io.RawIOBase):
+    """
+    Sequential reader over one archive member.
+
+    Extraction runs on a background thread feeding a queue of at most queue_size chunks,
+    so memory use is bounded by the queue no matter how large the member is.
+    Closing the reader early aborts the extraction.
+    """
+    def __init__(self, item, password=None, queue_size: int=QUEUE_SIZE):
+        super().__init__()
+        self.item = item
+        self._chunks = queue.Queue(queue_size)
+        self._closing = threading.Event()
+        self._chunk = memoryview(b'')
+        self._eof = False
+        self._thread = threading.Thread(
+            target=self._run, args=(password,), name='lib7zip-reader-{}'.format(item.index), daemon=True)
+        # see archive.ArchiveLock: until decoding is done, this thread can't wait for the archive's lock
+        self._owner = threading.get_ident()
+        item.archive.lock.reader_started(self._owner, self._thread)
+        try:
+            self._thread.start()
+        except BaseException:
+            item.archive.lock.reader_done(self._owner, self._thread)
+            raise
+
+    def _run(self, password):
+        try:
+            self.item.extract(ChunkQueueWriter(self._chunks, self._closing), password=password)
+        except Exception as ex:
+            if not self._closing.is_set():
+                log.debug('extraction of item %d failed: %r', self.item.index, ex)
+                self._chunks.put(ex)
+        else:
+            if not self._closing.is_set():
+                self._chunks.put(_EOF)
+        finally:
+            self.item.archive.lock.reader_done(self._owner, self._thread)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+        while not self._chunk:
+            if self._eof:
+                return 0
+            chunk = self._chunks.get()
+            if chunk is _EOF:
+                self._eof = True
+                self._thread.join()
+                return 0
+            if isinstance(chunk, Exception):
+                self._eof = True
+                raise chunk
+            self._chunk = memoryview(chunk)
+
+        out = memoryview(b).cast('B')
+        size = min(len(out), len(self._chunk))
+        out[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._closing.set()
+            # keep the queue drained until the decoder notices and gives up
+            while self._thread.is_alive():
+                try:
+                    while True:
+                        self._chunks.get_nowait()
+                except queue.Empty:
+                    pass
+                self._thread.join(0.01)
+            self._chunk = memoryview(b'')
+        super().close()
+
+
+class SeekableMemberReader(io.RawIOBase):
+    """
+    Random-access reader over one archive member, through the IInStream the handler hands out for it:
+    reads and seeks go straight to the member's bytes in the archive, nothing is extracted first.
+
+    Holds a reference to in_stream, released on close. Every call holds the archive's lock,
+    the member's stream reads through the archive's own input stream.
+    """
+    def __init__(self, item, in_stream):
+        super().__init__()
+        self.item = item
+        self._lock = item.archive.lock
+        self._stream = in_stream
+        self._processed = ffi.new('uint32_t*')
+        self._position = ffi.new('uint64_t*')
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+        out = memoryview(b).cast('B')
+        if not out:
+            return 0
+        # Read takes a 32-bit size
+        size = min(len(out), 0xFFFFFFFF)
+        with self._lock:
+            RNOK(self._stream.vtable.Read(self._stream, ffi.from_buffer(out), size, self._processed))
+        return self._processed[0]
+
+    def seek(self, offset: int, whence: int=io.SEEK_SET) -> int:
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+        with self._lock:
+            RNOK(self._stream.vtable.Seek(self._stream, offset, whence, self._position))
+        return self._position[0]
+
+    def tell(self) -> int:
+        return self.seek(0, io.SEEK_CUR)
+
+    def close(self):
+        if self._stream is not None:
+            stream, self._stream = self._stream, None
+            with self._lock:
+                stream.vtable.Release(stream)
+        super().close()
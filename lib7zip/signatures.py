@@ -0,0 +1,46 @@
+"""
+Index of the signatures of every format 7-Zip handles, to find the formats a file may be in from its first bytes
+"""
+
+
+def split_multi_signature(data: bytes) -> tuple[bytes, ...]:
+    """FormatProps.kMultiSignature -> signatures: each one is preceded by its length, as one byte"""
+    signatures = []
+    pos = 0
+    while pos < len(data):
+        size = data[pos]
+        signatures.append(data[pos + 1:pos + 1 + size])
+        pos += 1 + size
+    return tuple(signature for signature in signatures if signature)
+
+
+class SignatureIndex:
+    """
+    Signatures of formats grouped by the offset they're found at, then by their first byte,
+    so matching the head of a file only compares the few signatures that can possibly match.
+    """
+    def __init__(self, formats: dict):
+        #: offset -> first byte -> [(signature, format index, format name)]
+        self.tables = {}
+        #: bytes to read from the start of a file to check every signature
+        self.read_size = 0
+        for name, format in formats.items():
+            for signature in format.signatures:
+                table = self.tables.setdefault(format.signature_offset, {})
+                table.setdefault(signature[0], []).append((signature, format.index, name))
+                self.read_size = max(self.read_size, format.signature_offset + len(signature))
+
+    def match(self, head: bytes) -> list[str]:
+        """
+        names of the formats with a signature found in head, the first bytes of a file,
+        longest signature first, then in 7-Zip's order
+        """
+        matches = {}
+        for offset, table in self.tables.items():
+            if offset >= len(head):
+                continue
+            for signature, index, name in table.get(head[offset], ()):
+                if head.startswith(signature, offset):
+                    key = (-len(signature), index)
+                    matches[name] = min(key, matches.get(name, key))
+        return sorted(matches, key=matches.__getitem__)
@@ -3,6 +3,7 @@
 Simple COM, using DRY principles, but w/o too much meta
 """
 import logging
+import threading
 from . import ffi, guidp2uuid
 from . import wintypes
 from .comtypes import IID_IUnknown
@@ -25,11 +26,17 @@ def createCOMStructs(classname : str, ctypes : str):
 """
 
 class IUnknownImpl:
-    def __init__(self):
+    def __init__(self, stats=None):
+        """stats: optional stats.Stats every method called from 7-Zip is timed and counted in"""
+        self.stats = stats
         self.ref = 1
+        # 7-Zip may add and release references from any of its threads
+        self._ref_lock = threading.Lock()
         self.vtables = []
         self.instances = {}
         self.methods = {}
+        #: last exception raised by one of our methods while called from 7-Zip
+        self.error = None
 
         for iid, interface in self.GUIDS.items():
             vtable = ffi.new('_' + interface + '_vtable*')
@@ -43,42 +50,57 @@ class IUnknownImpl:
                     method = self.methods[name]
                 except KeyError:
                     ctype = ffi.typeof(getattr(vtable, name))
-                    self.methods[name] = method = ffi.callback(ctype, getattr(self, name))
+                    fn = getattr(self, name)
+                    if stats is not None:
+                        fn = stats.wrap(type(self).__name__ + '.' + name, fn)
+                    # an exception must not turn into S_OK on the way back to 7-Zip
+                    error = 0 if name in {'AddRef', 'Release'} else HRESULT.E_FAIL.value
+                    self.methods[name] = method = ffi.callback(
+                        ctype, fn, error=error, onerror=self._on_error)
 
                 setattr(vtable, name, method)
             self.vtables.append(vtable)
             self.instances[iid] = instance
 
+    def _on_error(self, exc_type, exc_value, traceback):
+        log.debug('%s raised in callback on %s', exc_type.__name__, type(self).__name__, exc_info=exc_value)
+        self.error = exc_value
+
     def QueryInterface(self, me, iid, out_ref):
         uu = guidp2uuid(iid)
         #log.debug('Callback Interface Queried %r' % (uu) )
-        self.ref += 1
         if uu == IID_IUnknown:
             log.debug('IIUnknown Queried')
             out_ref[0] = me
+            self.AddRef(me)
             return HRESULT.S_OK.value
         elif uu in self.instances:
-            log.debug('found guid: %s' % self.GUIDS[uu])
+            log.debug('found guid: %s', self.GUIDS[uu])
             out_ref[0] = self.instances[uu]
             #out_ref[0] = me
+            self.AddRef(me)
             return HRESULT.S_OK.value
         else:
-            log.debug('Unknown GUID {!r} on {}'.format(uu, type(self).__name__))
+            log.debug('Unknown GUID %r on %s', uu, type(self).__name__)
 
             out_ref[0] = ffi.NULL
             return HRESULT.E_NOINTERFACE.value
 
     def AddRef(self, me):
         log.debug('callback AddRef')
-        self.ref += 1
-        log.debug('refcount: {}'.format(self.ref))
-        return self.ref
+        with self._ref_lock:
+            self.ref += 1
+            ref = self.ref
+        log.debug('refcount: %d', ref)
+        return ref
 
     def Release(self, me):
         log.debug('callback Release')
-        self.ref -= 1
-        log.debug('refcount: {}'.format(self.ref))
-        return self.ref
+        with self._ref_lock:
+            self.ref -= 1
+            ref = self.ref
+        log.debug('refcount: %d', ref)
+        return ref
 
     def __del__(self):
         log.debug('__del__')
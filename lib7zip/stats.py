@@ -0,0 +1,143 @@
+"""
+Opt-in instrumentation of the COM boundary: how often and for how long 7-Zip calls back into Python,
+how many bytes move through the streams and how long is spent inside 7z.dll/7z.so itself.
+
+Nothing here runs unless an Archive is created with stats, methods of COM objects are only wrapped then.
+"""
+from contextlib import contextmanager
+import threading
+from time import perf_counter
+from typing import Callable, Optional
+
+from . import ffi
+
+#: methods whose 4th argument is the processed size, counted as bytes moved
+BYTE_METHODS = frozenset({'Read', 'Write'})
+
+
+class OpStats:
+    __slots__ = ('calls', 'bytes', 'time', 'chunk_sizes')
+
+    def __init__(self):
+        self.calls = 0
+        self.bytes = 0
+        self.time = 0.0
+        # chunk size rounded up to a power of two -> number of chunks
+        self.chunk_sizes = {}
+
+    def as_dict(self) -> dict:
+        return {
+            'calls': self.calls,
+            'bytes': self.bytes,
+            'time': self.time,
+            'chunk_sizes': dict(sorted(self.chunk_sizes.items())),
+        }
+
+
+class Stats:
+    """
+    Counters per operation: Python callbacks are named '<class>.<method>' (e.g. 'FileOutStream.Write'),
+    calls into 7-Zip by their method name ('Open', 'Extract').
+
+    hook, if given, is called as hook(op, elapsed, nbytes) for every event recorded,
+    nbytes is None for anything but reads and writes.
+    One Stats object may be shared by several archives to aggregate them.
+
+    Time spent in callbacks is charged to the calls into 7-Zip in progress when they happen, whichever
+    thread they run on: 7-Zip's multithreaded coders (LZMA2, BZip2...) call Read/Write from threads of
+    their own. With several calls in progress at once on one Stats (archives used concurrently) each of
+    them is charged all of it, the split between callback and native time is only approximate then.
+    """
+    def __init__(self, hook: Optional[Callable[[str, float, Optional[int]], None]]=None):
+        self.hook = hook
+        self.callbacks = {}
+        self.native_calls = {}
+        self._lock = threading.Lock()
+        # time spent in callbacks while any call into 7-Zip was in progress, see native()
+        self._callback_time = 0.0
+        self._native_active = 0
+
+    def wrap(self, op: str, method: Callable) -> Callable:
+        """method, timing and counting every call under op"""
+        counts_bytes = op.rpartition('.')[2] in BYTE_METHODS
+
+        def timed(*args):
+            start = perf_counter()
+            try:
+                return method(*args)
+            finally:
+                elapsed = perf_counter() - start
+                nbytes = None
+                if counts_bytes:
+                    processed_size = args[3]
+                    nbytes = int(processed_size[0]) if processed_size != ffi.NULL else int(args[2])
+                self.record(op, elapsed, nbytes)
+
+        return timed
+
+    def record(self, op: str, elapsed: float, nbytes: Optional[int]=None):
+        with self._lock:
+            try:
+                op_stats = self.callbacks[op]
+            except KeyError:
+                op_stats = self.callbacks[op] = OpStats()
+            op_stats.calls += 1
+            op_stats.time += elapsed
+            if nbytes is not None:
+                op_stats.bytes += nbytes
+                bucket = 1 << max(nbytes - 1, 0).bit_length()
+                op_stats.chunk_sizes[bucket] = op_stats.chunk_sizes.get(bucket, 0) + 1
+            if self._native_active:
+                self._callback_time += elapsed
+        if self.hook is not None:
+            self.hook(op, elapsed, nbytes)
+
+    @contextmanager
+    def native(self, op: str):
+        """time a call into 7-Zip, separating out the time its callbacks spend in Python"""
+        with self._lock:
+            self._native_active += 1
+            callback_start = self._callback_time
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            with self._lock:
+                self._native_active -= 1
+                # callbacks on several of 7-Zip's threads at once can add up to more than the wall time
+                callback_time = min(self._callback_time - callback_start, elapsed)
+                try:
+                    op_stats = self.native_calls[op]
+                except KeyError:
+                    op_stats = self.native_calls[op] = {'calls': 0, 'time': 0.0, 'callback_time': 0.0}
+                op_stats['calls'] += 1
+                op_stats['time'] += elapsed
+                op_stats['callback_time'] += callback_time
+            if self.hook is not None:
+                self.hook(op, elapsed, None)
+
+    def snapshot(self) -> dict:
+        """
+        copy of all counters. 'native' has, per call into 7-Zip, the wall time, the part of it spent in
+        Python callbacks and the rest ('native_time') spent decoding or parsing inside the library.
+        """
+        with self._lock:
+            callbacks = {op: op_stats.as_dict() for op, op_stats in sorted(self.callbacks.items())}
+            native = {
+                op: dict(op_stats, native_time=op_stats['time'] - op_stats['callback_time'])
+                for op, op_stats in sorted(self.native_calls.items())
+            }
+
+        def total(method, key):
+            return sum(op_stats[key] for op, op_stats in callbacks.items() if op.endswith('.' + method))
+
+        return {
+            'callbacks': callbacks,
+            'native': native,
+            'bytes_read': total('Read', 'bytes'),
+            'bytes_written': total('Write', 'bytes'),
+            'seeks': total('Seek', 'calls'),
+            'callback_time': sum(op_stats['time'] for op_stats in callbacks.values()),
+            'native_time': sum(op_stats['native_time'] for op_stats in native.values()),
+        }
@@ -1,3 +1,5 @@
+import hashlib
+import io
 import logging
 import os
 
@@ -10,36 +12,50 @@ from . import ffi, wintypes
 from .simplecom import IUnknownImpl
 log = logging.getLogger(__name__)
 
+#: output chunks smaller than this are gathered and written to real files with a single syscall
+WRITE_COALESCE_SIZE = 1 << 16
+
 class FileInStream(IUnknownImpl):
     """
             Implementation of IInStream and ISequentialInStream on top of python file-like objects
 
-            Creator responsible for closing the file-like objects.
+            Creator responsible for closing the file-like objects, unless close_file is set.
     """
     GUIDS = {
         IID_IInStream: 'IInStream',
         IID_ISequentialInStream: 'ISequentialInStream',
     }
 
-    def __init__(self, file):
+    def __init__(self, file, stats=None, close_file: bool=False):
         try:
             path = os.fspath(file)
         except TypeError:
             self.filelike = file
+            self._owns_file = close_file
         else:
             self.filelike = open(path, 'rb')
-        super().__init__()
+            self._owns_file = True
+        super().__init__(stats)
+
+    def close(self):
+        """close the file if it was opened from a path (or close_file was set)"""
+        if self._owns_file:
+            self.filelike.close()
 
     def Read(self, me, data, size, processed_size):
         log.debug('Read size=%d', size)
-        buf = self.filelike.read(size)
-        psize = len(buf)
+        readinto = getattr(self.filelike, 'readinto', None)
+        if readinto is not None:
+            psize = readinto(ffi.buffer(data, size)) or 0
+        else:
+            buf = self.filelike.read(size)
+            psize = len(buf)
+            ffi.memmove(data, buf, psize)
 
         if processed_size != ffi.NULL:
             processed_size[0] = psize
 
-        data[0:psize] = buf[0:psize]
-        log.debug('processed size: {}'.format(psize))
+        log.debug('processed size: %d', psize)
 
         return HRESULT.S_OK.value
 
@@ -52,6 +68,57 @@ class FileInStream(IUnknownImpl):
         return HRESULT.S_OK.value
 
 
+class BufferInStream(IUnknownImpl):
+    """
+            Implementation of IInStream and ISequentialInStream serving Read/Seek straight out of
+            any object supporting the buffer protocol (bytes, bytearray, mmap, shared memory, numpy arrays...)
+
+            Every Read is a single memcpy into 7-Zip's buffer, the buffer must not be resized while in use.
+    """
+    GUIDS = {
+        IID_IInStream: 'IInStream',
+        IID_ISequentialInStream: 'ISequentialInStream',
+    }
+
+    def __init__(self, buffer, stats=None):
+        self.view = memoryview(buffer).cast('B')
+        self.pos = 0
+        super().__init__(stats)
+
+    def close(self):
+        """release the underlying buffer"""
+        self.view.release()
+
+    def Read(self, me, data, size, processed_size):
+        log.debug('Read size=%d', size)
+        psize = max(min(size, len(self.view) - self.pos), 0)
+        if psize:
+            ffi.memmove(data, self.view[self.pos:self.pos + psize], psize)
+            self.pos += psize
+
+        if processed_size != ffi.NULL:
+            processed_size[0] = psize
+
+        return HRESULT.S_OK.value
+
+    def Seek(self, me, offset, origin, newposition):
+        log.debug('Seek offset=%d; origin=%d', offset, origin)
+        if origin == os.SEEK_SET:
+            newpos = offset
+        elif origin == os.SEEK_CUR:
+            newpos = self.pos + offset
+        elif origin == os.SEEK_END:
+            newpos = len(self.view) + offset
+        else:
+            return HRESULT.E_INVALIDARG.value
+        if newpos < 0:
+            return HRESULT.E_INVALIDARG.value
+        self.pos = newpos
+        if newposition != ffi.NULL:
+            newposition[0] = newpos
+        return HRESULT.S_OK.value
+
+
 class WrapInStream:
     def __init__(self, instream):
         self.instream = instream
@@ -83,6 +150,11 @@ class FileOutStream(IUnknownImpl):
     """
             Implementation of IOutStream and ISequentialOutStream on top of Python file-like objects.
 
+            write() is handed a memoryview over 7-Zip's own buffer, it is only valid for the duration of the call.
+            Real files are written straight to their descriptor and small chunks are coalesced,
+            call flush() (or close()) once extraction is done.
+            hashes names hashlib algorithms fed everything written, see hexdigests().
+
             Creator is responsible for flushing/closing the file-like object
     """
     GUIDS = {
@@ -90,29 +162,201 @@ class FileOutStream(IUnknownImpl):
         IID_ISequentialOutStream: 'ISequentialOutStream',
     }
 
-    def __init__(self, file):
+    def __init__(self, file, stats=None, hashes=()):
         try:
             path = os.fspath(file)
         except TypeError:
             self.filelike = file
+            self._owns_file = False
         else:
-            self.filelike = open(path, 'wb')
-        super().__init__()
+            self.filelike = open(path, 'wb', buffering=0)
+            self._owns_file = True
+        self.fd = get_write_fd(self.filelike)
+        self._pending = bytearray()
+        self.hashes = {name: hashlib.new(name) for name in hashes or ()}
+        super().__init__(stats)
 
     def Write(self, me, data, size, processed_size):
         log.debug('Write %d', size)
-        data_arr = ffi.cast('uint8_t*', data)
-        buf = bytes(data_arr[0:size])
-        #log.debug('data: %s' % buf.decode('ascii'))
-        _processed_size = self.filelike.write(buf)
-        processed_size[0] = _processed_size
+        buf = memoryview(ffi.buffer(ffi.cast('char*', data), size))
+        if self.fd is not None:
+            self._write_fd(buf)
+            _processed_size = size
+        else:
+            _processed_size = self.filelike.write(buf)
+            if _processed_size is None:
+                _processed_size = size
+        if self.hashes:
+            if _processed_size != size:
+                buf = buf[:_processed_size]
+            for hash in self.hashes.values():
+                hash.update(buf)
+        if processed_size != ffi.NULL:
+            processed_size[0] = _processed_size
         log.debug('processed_size: %d', _processed_size)
         return HRESULT.S_OK.value
 
     def Seek(self, me, offset, origin, newposition):
         log.debug('Seek offset=%d; origin=%d', offset, origin)
-        newpos = self.filelike.seek(offset, origin)
+        if self.fd is not None:
+            self._flush_pending()
+            newpos = os.lseek(self.fd, offset, origin)
+        else:
+            newpos = self.filelike.seek(offset, origin)
         if newposition != ffi.NULL:
             newposition[0] = newpos
         log.debug('new position: %d', newpos)
         return HRESULT.S_OK.value
+
+    def _write_fd(self, buf):
+        if len(buf) < WRITE_COALESCE_SIZE:
+            # 7-Zip reuses its buffer as soon as Write returns, so small chunks have to be copied
+            self._pending += buf
+            if len(self._pending) >= WRITE_COALESCE_SIZE:
+                self._flush_pending()
+        else:
+            self._flush_pending(buf)
+
+    def _flush_pending(self, buf=None):
+        bufs = [self._pending] if self._pending else []
+        if buf is not None:
+            bufs.append(buf)
+        if bufs:
+            write_all(self.fd, bufs)
+        self._pending = bytearray()
+
+    def hexdigests(self) -> dict:
+        """hex digest of everything written so far for each of the hashes, by algorithm name"""
+        return {name: hash.hexdigest() for name, hash in self.hashes.items()}
+
+    def flush(self):
+        if self.fd is not None:
+            self._flush_pending()
+        flush = getattr(self.filelike, 'flush', None)
+        if flush is not None:
+            flush()
+
+    def close(self):
+        """flush, and close the file if it was opened from a path"""
+        self.flush()
+        if self._owns_file:
+            self.filelike.close()
+
+
+class BufferOutStream(IUnknownImpl):
+    """
+            Implementation of IOutStream and ISequentialOutStream writing straight into a writable buffer
+            (bytearray, mmap, shared memory, numpy arrays...) from offset on: every Write is a single memcpy
+            from 7-Zip's buffer, nothing is copied in between. Writing past the end of the buffer fails.
+
+            The buffer must not be resized while in use, close() releases it.
+    """
+    GUIDS = {
+        IID_IOutStream: 'IOutStream',
+        IID_ISequentialOutStream: 'ISequentialOutStream',
+    }
+
+    def __init__(self, buffer, offset: int=0, stats=None, hashes=()):
+        self.view = memoryview(buffer).cast('B')
+        if self.view.readonly:
+            self.view.release()
+            raise TypeError('buffer is read-only')
+        if not 0 <= offset <= len(self.view):
+            self.view.release()
+            raise ValueError('offset {} is outside the buffer'.format(offset))
+        self.dest = ffi.from_buffer(self.view)
+        self.offset = self.pos = offset
+        #: end of what was written, relative to offset
+        self.written = 0
+        self.hashes = {name: hashlib.new(name) for name in hashes or ()}
+        super().__init__(stats)
+
+    @property
+    def capacity(self) -> int:
+        """bytes that fit after offset"""
+        return len(self.view) - self.offset
+
+    def Write(self, me, data, size, processed_size):
+        log.debug('Write %d', size)
+        if self.pos + size > len(self.view):
+            raise BufferError('buffer too small: {} bytes from offset {} do not fit in {}'.format(
+                self.pos + size - self.offset, self.offset, len(self.view)))
+        ffi.memmove(self.dest + self.pos, data, size)
+        if self.hashes:
+            buf = self.view[self.pos:self.pos + size]
+            for hash in self.hashes.values():
+                hash.update(buf)
+        self.pos += size
+        self.written = max(self.written, self.pos - self.offset)
+        if processed_size != ffi.NULL:
+            processed_size[0] = size
+        return HRESULT.S_OK.value
+
+    def Seek(self, me, offset, origin, newposition):
+        log.debug('Seek offset=%d; origin=%d', offset, origin)
+        # positions are relative to offset, as if the stream started there
+        if origin == os.SEEK_SET:
+            newpos = offset
+        elif origin == os.SEEK_CUR:
+            newpos = self.pos - self.offset + offset
+        elif origin == os.SEEK_END:
+            newpos = self.written + offset
+        else:
+            return HRESULT.E_INVALIDARG.value
+        if newpos < 0:
+            return HRESULT.E_INVALIDARG.value
+        self.pos = self.offset + newpos
+        if newposition != ffi.NULL:
+            newposition[0] = newpos
+        return HRESULT.S_OK.value
+
+    def hexdigests(self) -> dict:
+        """hex digest of everything written so far for each of the hashes, by algorithm name"""
+        return {name: hash.hexdigest() for name, hash in self.hashes.items()}
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """release the underlying buffer"""
+        self.dest = None
+        self.view.release()
+
+
+class CallableWriter:
+    """
+            Minimal file-like object passing every chunk written to it on to a callable
+    """
+    def __init__(self, fn):
+        self.fn = fn
+
+    def write(self, buf) -> int:
+        self.fn(buf)
+        return len(buf)
+
+
+def get_write_fd(filelike):
+    """
+    file descriptor of filelike if it is a real file that can be written to directly, otherwise None
+    """
+    if not isinstance(filelike, (io.FileIO, io.BufferedWriter, io.BufferedRandom)):
+        return None
+    # anything still buffered has to land before we start writing around the buffer
+    filelike.flush()
+    return filelike.fileno()
+
+
+def write_all(fd, bufs):
+    """
+    write every buffer in bufs to fd, in order, retrying short writes
+    """
+    views = [memoryview(buf) for buf in bufs if len(buf)]
+    while views:
+        if hasattr(os, 'writev'):
+            written = os.writev(fd, views)
+        else:
+            written = os.write(fd, views[0])
+        while views and written >= len(views[0]):
+            written -= len(views.pop(0))
+        if written:
+            views[0] = views[0][written:]
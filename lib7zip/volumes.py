@@ -0,0 +1,143 @@
+"""
+Multi-volume archives: input streams over the individual volume files, sharing a bounded pool of open descriptors
+"""
+from bisect import bisect_right
+from collections import OrderedDict
+import os
+import re
+import threading
+from typing import List, Optional
+
+from .py7ziptypes import IID_IInStream, IID_ISequentialInStream
+from .simplecom import IUnknownImpl
+from .wintypes import HRESULT
+from . import ffi, log
+
+#: volumes kept open at a time by an archive unless told otherwise
+DEFAULT_MAX_OPEN_VOLUMES = 64
+
+# x.7z.001, x.zip.002, ... as written by `7z a -v` or split(1)
+SPLIT_VOLUME_RE = re.compile(r'^(?P<base>.+)\.(?P<number>\d{3,})$')
+
+
+def split_volumes(path: os.PathLike) -> Optional[List[str]]:
+    """
+    paths of all the volumes, in order, of the split set (x.001, x.002...) starting with path,
+    None if path isn't the first volume of such a set
+    """
+    path = os.fspath(path)
+    match = SPLIT_VOLUME_RE.match(path)
+    if match is None or int(match.group('number')) != 1:
+        return None
+    base, width = match.group('base'), len(match.group('number'))
+    volumes = []
+    number = 1
+    while True:
+        volume = '{}.{:0{}d}'.format(base, number, width)
+        if not os.path.exists(volume):
+            return volumes
+        volumes.append(volume)
+        number += 1
+
+
+class VolumePool:
+    """
+    Descriptors of open volume files, least recently used closed first once more than max_open are needed.
+    Reads are positional (pread) so several streams can share a descriptor.
+    """
+    def __init__(self, max_open: int=DEFAULT_MAX_OPEN_VOLUMES):
+        if max_open < 1:
+            raise ValueError('max_open must be at least 1')
+        self.max_open = max_open
+        self._fds = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _fd(self, path: str) -> int:
+        try:
+            self._fds.move_to_end(path)
+            return self._fds[path]
+        except KeyError:
+            pass
+        while len(self._fds) >= self.max_open:
+            _, fd = self._fds.popitem(last=False)
+            os.close(fd)
+        fd = self._fds[path] = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        return fd
+
+    def readinto(self, path: str, buf, offset: int) -> int:
+        """read from volume path at offset into buf, returns the number of bytes read (0 at the end)"""
+        # held while reading so no other thread closes the descriptor in between
+        with self._lock:
+            fd = self._fd(path)
+            if hasattr(os, 'preadv'):
+                return os.preadv(fd, [buf], offset)
+            os.lseek(fd, offset, os.SEEK_SET)
+            data = os.read(fd, len(buf))
+            buf[:len(data)] = data
+            return len(data)
+
+    @property
+    def open_count(self) -> int:
+        return len(self._fds)
+
+    def close(self):
+        with self._lock:
+            while self._fds:
+                os.close(self._fds.popitem()[1])
+
+
+class VolumeInStream(IUnknownImpl):
+    """
+            IInStream over the concatenation of one or more volume files read through a VolumePool,
+            a single volume handed to 7-Zip by the open callback or all the parts of a split archive.
+    """
+    GUIDS = {
+        IID_IInStream: 'IInStream',
+        IID_ISequentialInStream: 'ISequentialInStream',
+    }
+
+    def __init__(self, pool: VolumePool, paths: List[str], stats=None):
+        self.pool = pool
+        self.paths = paths
+        self.starts = []
+        size = 0
+        for path in paths:
+            self.starts.append(size)
+            size += os.path.getsize(path)
+        self.size = size
+        self.pos = 0
+        super().__init__(stats)
+
+    def close(self):
+        pass
+
+    def Read(self, me, data, size, processed_size):
+        log.debug('Read size=%d', size)
+        psize = 0
+        if self.pos < self.size and size:
+            # only up to the end of the current volume, 7-Zip asks again for the rest
+            volume = bisect_right(self.starts, self.pos) - 1
+            offset = self.pos - self.starts[volume]
+            psize = self.pool.readinto(self.paths[volume], ffi.buffer(data, size), offset)
+            self.pos += psize
+
+        if processed_size != ffi.NULL:
+            processed_size[0] = psize
+        return HRESULT.S_OK.value
+
+    def Seek(self, me, offset, origin, newposition):
+        log.debug('Seek offset=%d; origin=%d', offset, origin)
+        if origin == os.SEEK_SET:
+            newpos = offset
+        elif origin == os.SEEK_CUR:
+            newpos = self.pos + offset
+        elif origin == os.SEEK_END:
+            newpos = self.size + offset
+        else:
+            return HRESULT.E_INVALIDARG.value
+        if newpos < 0:
+            return HRESULT.E_INVALIDARG.value
+        self.pos = newpos
+        if newposition != ffi.NULL:
+            newposition[0] = newpos
+        return HRESULT.S_OK.value
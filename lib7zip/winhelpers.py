@@ -2,6 +2,7 @@
 Helper functions for dealing with windows types defined in wintypes like PROPVARIANT, GUID*, and HRESULT
 """
 
+import threading
 import uuid
 from . import ffi, C, free_propvariant, log
 from .wintypes import *
@@ -88,56 +89,85 @@ def alloc_propvariant():
     return ffi.gc(C.calloc(1, ffi.sizeof('PROPVARIANT')), dealloc_propvariant)
 #return ffi.new('PROPVARIANT*')
 
+
+_scratch = threading.local()
+
+
+def scratch_propvariant():
+    """
+    this thread's PROPVARIANT for reading one property at a time, allocated once and cleared after each use
+    """
+    try:
+        return _scratch.pvar
+    except AttributeError:
+        # the owner of the memory is kept along, it's freed with the thread
+        _scratch.ptr = ptr = alloc_propvariant()
+        _scratch.pvar = pvar = ffi.cast('PROPVARIANT*', ptr)
+        return pvar
+
+
+def _decode_bstr(pvar):
+    return None if pvar.bstrVal == ffi.NULL else ffi.string(pvar.bstrVal)
+
+
+def _decode_filetime(pvar):
+    return filetime_to_datetime((pvar.filetime.dwHighDateTime << 32) | pvar.filetime.dwLowDateTime)
+
+
+#: VARTYPE -> function turning a PROPVARIANT of that type into a Python value
+DECODERS = {
+    VARTYPE.VT_UI1: lambda pvar: int(pvar.bVal),
+    VARTYPE.VT_UI2: lambda pvar: int(pvar.uiVal),
+    VARTYPE.VT_I2: lambda pvar: int(pvar.iVal),
+    VARTYPE.VT_UI4: lambda pvar: int(pvar.ulVal),
+    VARTYPE.VT_UINT: lambda pvar: int(pvar.ulVal),
+    VARTYPE.VT_I4: lambda pvar: int(pvar.lVal),
+    VARTYPE.VT_UI8: lambda pvar: int(pvar.uhVal),
+    VARTYPE.VT_I8: lambda pvar: int(pvar.hVal),
+    VARTYPE.VT_BOOL: lambda pvar: pvar.bVal != 0,
+    VARTYPE.VT_CLSID: lambda pvar: guidp2uuid(pvar.puuid),
+    VARTYPE.VT_BSTR: _decode_bstr,
+    VARTYPE.VT_FILETIME: _decode_filetime,
+}
+
+
+def read_prop(fn, *args, forcetype=None, checktype=None):
+    """
+    call fn(*args, PROPVARIANT*) and decode the value it stored, None when empty.
+    The PROPVARIANT is this thread's scratch one, nothing is allocated unless the value is a string.
+    """
+    pvar = scratch_propvariant()
+    try:
+        RNOK(fn(*args, pvar))
+        vt = pvar.vt
+        if vt == VARTYPE.VT_EMPTY or vt == VARTYPE.VT_NULL:
+            return None
+        if checktype:
+            assert vt == checktype
+        try:
+            decoder = DECODERS[forcetype or vt]
+        except KeyError:
+            raise TypeError("type code %r not supported" % (forcetype or vt)) from None
+        return decoder(pvar)
+    finally:
+        free_propvariant(pvar)
+
+
 def get_prop_val(fn, forcetype=None, checktype=None):
     """
     fn should have the signature:
     HRESULT fn(PROPVARIANT*);
     """
-    ptr = alloc_propvariant()
-    RNOK(fn(ptr))
-    pvar = ffi.cast('PROPVARIANT*', ptr)
-    vt = forcetype or VARTYPE(pvar.vt)
-    if pvar.vt in (VARTYPE.VT_EMPTY, VARTYPE.VT_NULL):
-        # always check for null, pvar.vt is not a bug
-        return None
-
-    if checktype:
-        if checktype == True:
-            checktype = forcetype
-        assert pvar.vt == checktype
-
-    if vt == VARTYPE.VT_UI1:
-        return int(pvar.bVal)
-    elif vt == VARTYPE.VT_UI2:
-        return int(pvar.uiVal)
-    elif vt == VARTYPE.VT_I2:
-        return int(pvar.iVal)
-    elif vt in (VARTYPE.VT_UI4, VARTYPE.VT_UINT):
-        return int(pvar.ulVal)
-    elif vt == VARTYPE.VT_I4:
-        return int(pvar.lVal)
-    elif vt == VARTYPE.VT_UI8:
-        return int(pvar.uhVal)
-    elif vt == VARTYPE.VT_I8:
-        return int(pvar.hVal)
-    elif vt == VARTYPE.VT_BOOL:
-        return int(pvar.bVal) != 0
-    elif vt == VARTYPE.VT_CLSID:
-        return guidp2uu(pvar.puuid)
-    elif vt == VARTYPE.VT_BSTR:
-        return ffi.string(pvar.bstrVal)
-    elif vt == VARTYPE.VT_FILETIME:
-        timestamp = int(pvar.filetime.dwLowDateTime)
-        timestamp += int(pvar.filetime.dwHighDateTime) << 32
-        timestamp /= 10
-
-        #timestamp is now the number of seconds since Jan 1, 1601 CE
-        jan01_1601 = datetime(year=1601, month=1, day=1, tzinfo=timezone.utc)
-        delta = timedelta(microseconds=timestamp)
-        dt = jan01_1601 + delta
-        try:
-            return dt.astimezone()
-        except OSError:
-            return dt
-    else:
-        raise TypeError("type code %r not supported" % vt)
+    if checktype == True:
+        checktype = forcetype
+    return read_prop(fn, forcetype=forcetype, checktype=checktype)
+
+
+def filetime_to_datetime(ticks: int) -> datetime:
+    """FILETIME ticks (100ns intervals since Jan 1, 1601 CE) -> aware datetime in local time"""
+    jan01_1601 = datetime(year=1601, month=1, day=1, tzinfo=timezone.utc)
+    dt = jan01_1601 + timedelta(microseconds=ticks / 10)
+    try:
+        return dt.astimezone()
+    except OSError:
+        return dt
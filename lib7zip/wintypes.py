@@ -45,6 +45,7 @@ typedef wchar_t OLECHAR;
 HRESULT PropVariantClear(PROPVARIANT *pvar);
 BSTR SysAllocString(const OLECHAR *str);
 void SysFreeString(BSTR bstr);
+uint32_t SysStringByteLen(BSTR bstr);
 """
 
 #HRESULT values
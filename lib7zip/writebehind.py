@@ -0,0 +1,171 @@
+"""
+Write-behind for directory extraction: 7-Zip's decoder thread only copies its output into memory,
+a pool of writer threads opens, writes and closes the files meanwhile.
+"""
+import logging
+import queue
+import threading
+
+from .stream import write_all
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+#: decoded data waiting to be written, the decoder blocks beyond this
+DEFAULT_MAX_BYTES = 64 << 20
+
+
+class WriteGroup:
+    """
+    Operations of one extraction on a (possibly shared) WriteBehind: how many are pending and the first
+    exception one of them raised, kept apart from the other extractions using the writer.
+    """
+    def __init__(self):
+        self.error = None
+        self.pending = 0
+
+
+class WriteBehind:
+    """
+    Pool of writer threads running operations submitted under a key: operations with the same key
+    (on the same file) run on the same thread in order, different keys are spread over the threads.
+
+    At most max_bytes of data are queued at a time, submit() blocks until the writers catch up.
+    Operations belong to a WriteGroup (see group(), one per extraction sharing the writer) or to the writer's
+    own default group. The first exception raised by an operation is raised again by the next submit() or
+    drain() of its group, later operations of the group are skipped unless submitted with always=True
+    (closing files). drain() clears the error it raises, the group can be used again afterwards.
+    """
+    def __init__(self, workers: int=DEFAULT_WORKERS, max_bytes: int=DEFAULT_MAX_BYTES):
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self._default = WriteGroup()
+        self._pending_bytes = 0
+        self._pending_ops = 0
+        self._cond = threading.Condition()
+        self._queues = [queue.SimpleQueue() for _ in range(workers)]
+        self._threads = [
+            threading.Thread(target=self._run, args=(ops,), name='lib7zip-writer-{}'.format(n), daemon=True)
+            for n, ops in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def error(self):
+        """first exception raised by an operation of the default group, until drained"""
+        return self._default.error
+
+    def group(self) -> WriteGroup:
+        """a new group of operations, to submit and drain one extraction's writes on their own"""
+        return WriteGroup()
+
+    def submit(self, key: int, fn, *args, nbytes: int=0, always: bool=False, group: WriteGroup=None):
+        group = group or self._default
+        with self._cond:
+            # a chunk larger than the whole budget still goes through on its own
+            while self._pending_bytes and self._pending_bytes + nbytes > self.max_bytes and group.error is None:
+                self._cond.wait()
+            if group.error is not None and not always:
+                raise group.error
+            self._pending_bytes += nbytes
+            self._pending_ops += 1
+            group.pending += 1
+        self._queues[key % self.workers].put((fn, args, nbytes, always, group))
+
+    def _run(self, ops: queue.SimpleQueue):
+        while True:
+            op = ops.get()
+            if op is None:
+                return
+            fn, args, nbytes, always, group = op
+            try:
+                if group.error is None or always:
+                    fn(*args)
+            except BaseException as ex:
+                log.debug('write-behind operation failed: %r', ex)
+                with self._cond:
+                    if group.error is None:
+                        group.error = ex
+            finally:
+                with self._cond:
+                    self._pending_bytes -= nbytes
+                    self._pending_ops -= 1
+                    group.pending -= 1
+                    self._cond.notify_all()
+
+    def drain(self, group: WriteGroup=None):
+        """
+        wait for the operations of group (the default group if None) submitted so far to be done,
+        then raise and clear its error if one failed
+        """
+        group = group or self._default
+        with self._cond:
+            while group.pending:
+                self._cond.wait()
+            error, group.error = group.error, None
+        if error is not None:
+            raise error
+
+    def close(self):
+        """wait for every operation, raise the default group's error if any, and stop the writer threads"""
+        if not self._threads:
+            return
+        try:
+            with self._cond:
+                while self._pending_ops:
+                    self._cond.wait()
+            self.drain()
+        finally:
+            for ops in self._queues:
+                ops.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+
+    def __enter__(self) -> 'WriteBehind':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class DeferredFile:
+    """
+    Write-only file-like object whose open, writes and close happen on a WriteBehind thread.
+
+    on_open is called with the file descriptor right after opening, on_close right before closing.
+    Operations are submitted as part of group (see WriteBehind.group), the writer's default group if None.
+    """
+    def __init__(self, writer: WriteBehind, key: int, path, on_open=None, group: WriteGroup=None):
+        self.writer = writer
+        self.key = key
+        self.group = group or writer._default
+        self.file = None
+        writer.submit(key, self._open, path, on_open, group=self.group)
+
+    def _open(self, path, on_open):
+        self.file = open(path, 'wb', buffering=0)
+        if on_open is not None:
+            on_open(self.file.fileno())
+
+    def write(self, buf) -> int:
+        # 7-Zip reuses its buffer as soon as Write returns
+        data = bytes(buf)
+        self.writer.submit(self.key, self._write, data, nbytes=len(data), group=self.group)
+        return len(data)
+
+    def _write(self, data):
+        write_all(self.file.fileno(), [data])
+
+    def close(self, on_close=None):
+        self.writer.submit(self.key, self._close, on_close, always=True, group=self.group)
+
+    def _close(self, on_close):
+        if self.file is None:
+            return
+        try:
+            if on_close is not None and self.group.error is None:
+                on_close(self.file.fileno())
+        finally:
+            self.file.close()
@@ -1,3 +1,4 @@
+import asyncio
 from functools import partial
 from glob import glob
 import io
@@ -106,3 +107,793 @@ def test_extract_badpass():
         stream = io.BytesIO()
         with pytest.raises(ExtractionError):
             archive[0].extract(stream, password='notthepass')
+
+@pytest.mark.parametrize('path', simple_archives)
+def test_extract_item_to_file(path, tmp_dir):
+    out_path = os.path.join(tmp_dir, 'item_to_file.txt')
+    with Archive(path) as archive:
+        archive[0].extract(out_path)
+        with open(out_path, 'wb') as f:
+            archive[0].extract(f)
+
+    with open(out_path, 'rb') as f:
+        assert f.read() == b'Hello World!\n'
+
+def test_out_stream_coalesces_writes(tmp_dir):
+    from lib7zip import ffi
+    from lib7zip.stream import FileOutStream, WRITE_COALESCE_SIZE
+
+    chunks = [b'a' * 10, b'b' * 100, b'c' * WRITE_COALESCE_SIZE, b'd' * 7]
+    out_path = os.path.join(tmp_dir, 'coalesced.bin')
+    stream = FileOutStream(out_path)
+    processed = ffi.new('uint32_t*')
+    for chunk in chunks:
+        data = ffi.new('char[]', chunk)
+        stream.Write(ffi.NULL, data, len(chunk), processed)
+        assert processed[0] == len(chunk)
+    stream.close()
+
+    with open(out_path, 'rb') as f:
+        assert f.read() == b''.join(chunks)
+
+@pytest.mark.parametrize('path', simple_archives)
+def test_from_buffer(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    with Archive.from_buffer(data, os.path.basename(path)) as archive:
+        assert archive[0].path == 'hello.txt'
+        assert archive[0].contents == b'Hello World!\n'
+
+def test_from_mmap():
+    import mmap
+    with open('tests/complex.7z', 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        with Archive.from_buffer(mm, 'complex.7z') as archive:
+            assert archive.type_name == '7z'
+            for item in archive:
+                if item.path in COMPLEX_MD and not item.is_dir:
+                    assert item.contents.decode('utf-8') == COMPLEX_MD[item.path].contents
+
+def test_from_mmap_junk():
+    import mmap
+    from lib7zip.archive import ArchiveOpenError
+    # the buffer must be released when opening fails, or closing the mmap hides the error
+    with pytest.raises(ArchiveOpenError):
+        with mmap.mmap(-1, 4096) as mm:
+            mm.write(b'PK\x03\x04 not really a zip' * 100)
+            Archive.from_buffer(mm, 'junk.zip')
+
+def test_extract_many():
+    with Archive('tests/complex.7z') as archive:
+        files = {item.index: item.path for item in archive if item.path in COMPLEX_MD and not item.is_dir}
+        contents = archive.extract_many(files)
+        assert set(contents) == set(files)
+        for index, data in contents.items():
+            assert data.decode('utf-8') == COMPLEX_MD[files[index]].contents
+
+def test_extract_many_sinks(tmp_dir):
+    chunks = []
+    with Archive('tests/complex.7z') as archive:
+        by_path = {item.path: item for item in archive}
+        hello = by_path[J('complex', 'hello.txt')]
+        goodbye = by_path[J('complex', 'goodbye.txt')]
+        out_path = os.path.join(tmp_dir, 'many_hello.txt')
+
+        def sink_factory(item):
+            if item.index == hello.index:
+                return out_path
+            return lambda buf: chunks.append(bytes(buf))
+
+        archive.extract_many([goodbye, hello.index], sink_factory)
+
+    with open(out_path, 'rb') as f:
+        assert f.read() == b'Hello!'
+    assert b''.join(chunks) == b'Goodbye!'
+
+def test_metadata():
+    from lib7zip.metadata import MISSING
+
+    with Archive('tests/complex.7z') as archive:
+        columns = archive.metadata()
+        assert len(columns['path']) == len(archive)
+        for index, path in enumerate(columns['path']):
+            md = COMPLEX_MD.get(path)
+            if md is None:
+                continue
+            assert bool(columns['is_dir'][index]) == md.isdir
+            assert columns['crc'][index] == (MISSING if md.crc is None else md.crc)
+            if not md.isdir:
+                assert columns['size'][index] == len(md.contents.encode('utf-8'))
+
+def test_path_lookup():
+    with Archive('tests/complex.7z') as archive:
+        item = archive[J('complex', 'hello.txt')]
+        assert item.contents == b'Hello!'
+        assert archive['complex/articles/the indefinate article.txt'].contents == b'a'
+        with pytest.raises(KeyError):
+            archive['complex/missing.txt']
+
+def test_listdir_glob_exists():
+    with Archive('tests/complex.7z') as archive:
+        assert archive.listdir() == ['complex']
+        assert archive.listdir('complex') == [
+            'articles', 'empty', 'empty.txt', 'goodbye.txt', 'hello.txt', 'unicode.txt']
+        assert archive.exists('complex/articles')
+        assert not archive.exists('complex/nope')
+        with pytest.raises(NotADirectoryError):
+            archive.listdir('complex/hello.txt')
+        assert sorted(archive.glob('complex/[gh]*.txt')) == [J('complex', 'goodbye.txt'), J('complex', 'hello.txt')]
+        assert len(archive.glob('**/*article.txt')) == 2
+
+@pytest.mark.parametrize('path', simple_archives)
+def test_open_item(path):
+    with Archive(path) as archive:
+        with archive[0].open() as f:
+            assert f.read() == b'Hello World!\n'
+            assert f.read() == b''
+        with io.BufferedReader(archive[0].open(queue_size=1)) as f:
+            assert f.read(5) == b'Hello'
+
+def test_open_item_lock(tmp_dir):
+    import threading
+    import zipfile
+    from lib7zip.archive import ReaderLockError
+
+    path = J(tmp_dir, 'big.zip')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('big.bin', os.urandom(1 << 16) * 128)
+        zf.writestr('small.txt', b'small')
+
+    with Archive(path) as archive:
+        with archive['big.bin'].open(queue_size=1) as f:
+            assert len(f.read(1)) == 1
+            # the decoder holds the lock until this thread drains the reader
+            with pytest.raises(ReaderLockError):
+                archive['small.txt'].contents
+            # other threads wait for it
+            results = []
+            thread = threading.Thread(target=lambda: results.append(archive['small.txt'].contents))
+            thread.start()
+            thread.join(0.1)
+            assert thread.is_alive()
+        thread.join()
+        assert results == [b'small']
+        # only a lock held by one of its decoders is refused, any other holder is waited for
+        held, release = threading.Event(), threading.Event()
+
+        def hold():
+            with archive.lock:
+                held.set()
+                release.wait()
+        holder = threading.Thread(target=hold)
+        holder.start()
+        held.wait()
+        with archive['big.bin'].open(queue_size=1) as f:
+            assert not archive.lock.acquire(timeout=0.1)
+            release.set()
+            holder.join()
+            assert len(f.read()) == 1 << 23
+        with archive['big.bin'].open() as f:
+            assert len(f.read()) == 1 << 23
+            out = io.BytesIO()
+            archive['small.txt'].extract(out)
+            assert out.getvalue() == b'small'
+
+def test_open_item_badpass():
+    with Archive('tests/simple_crypt.7z') as archive:
+        with archive[0].open(password='notthepass') as f:
+            with pytest.raises(ExtractionError):
+                f.read()
+
+def test_stats():
+    import threading
+    import time
+    events = []
+    from lib7zip.stats import Stats
+
+    with Archive('tests/complex.7z') as archive:
+        assert archive.stats() is None
+
+    stats = Stats(hook=lambda op, elapsed, nbytes: events.append(op))
+    # without a cache, that would capture goodbye.txt on the way
+    with Archive('tests/complex.7z', stats=stats, cache_size=0) as archive:
+        assert archive[J('complex', 'hello.txt')].contents == b'Hello!'
+        snapshot = archive.stats()
+
+    assert snapshot['bytes_written'] == len(b'Hello!')
+    assert snapshot['bytes_read'] > 0
+    assert snapshot['native']['Open']['calls'] == 1
+    assert snapshot['native']['Extract']['calls'] == 1
+    assert snapshot['callbacks']['FileOutStream.Write']['chunk_sizes'] == {8: 1}
+    assert 'FileInStream.Read' in events
+
+    # 7-Zip's multithreaded coders call back from threads of their own
+    stats = Stats()
+    with stats.native('Extract'):
+        coder = threading.Thread(target=lambda: stats.wrap('ExtractCallback.SetOperationResult', time.sleep)(0.05))
+        coder.start()
+        coder.join()
+    assert stats.snapshot()['native']['Extract']['callback_time'] >= 0.05
+
+def test_tables_cache(tmp_dir, monkeypatch):
+    import json
+    import lib7zip
+
+    formats, methods = lib7zip.get_format_info(), lib7zip.get_method_info()
+    data = json.loads(json.dumps(lib7zip.tables_to_json(formats, methods)))
+    assert lib7zip.tables_from_json(data) == (formats, methods)
+
+    monkeypatch.setenv('LIB7ZIP_CACHE_DIR', os.path.join(tmp_dir, 'cache'))
+    cache_path = lib7zip.tables_cache_path()
+    lib7zip.write_tables_cache(cache_path, formats, methods)
+    with open(cache_path, encoding='utf-8') as f:
+        assert lib7zip.tables_from_json(json.load(f)) == (formats, methods)
+
+def test_decode_units():
+    with Archive('tests/complex.7z') as archive:
+        units = archive.decode_units()
+        assert sorted(index for unit in units for index in unit) == list(range(len(archive)))
+        # goodbye.txt and hello.txt share a solid block
+        pair = {archive[J('complex', 'goodbye.txt')].index, archive[J('complex', 'hello.txt')].index}
+        assert pair in [set(unit) for unit in units]
+
+@pytest.mark.parametrize('path', ('tests/complex.7z', 'tests/simple.zip'))
+def test_extract_parallel(path, tmp_dir):
+    out_dir = os.path.join(tmp_dir, 'parallel', os.path.basename(path))
+    with Archive(path) as archive:
+        assert archive.extract(out_dir, workers=2)
+        expected = {item.path: item.contents for item in archive if not item.is_dir}
+
+    for item_path, contents in expected.items():
+        with open(os.path.join(out_dir, item_path), 'rb') as f:
+            assert f.read() == contents
+
+def test_extract_parallel_dir_mtime(tmp_dir):
+    import zipfile
+    path = J(tmp_dir, 'tree.zip')
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr(zipfile.ZipInfo('top/', date_time=(2001, 2, 3, 4, 5, 6)), b'')
+        for n in range(400):
+            zf.writestr('top/{}.txt'.format(n), b'x' * n)
+
+    with Archive(path) as archive:
+        top = archive['top']
+        assert top.is_dir
+        # directories get their metadata once every worker has written the files in them
+        assert archive.extract(J(tmp_dir, 'tree'), workers=3)
+        assert abs(os.stat(J(tmp_dir, 'tree', 'top')).st_mtime - top.mtime.timestamp()) < 1e-5
+        assert len(os.listdir(J(tmp_dir, 'tree', 'top'))) == 400
+
+def test_aio():
+    from lib7zip.aio import AsyncArchive
+
+    async def main():
+        async with AsyncArchive('tests/complex.7z') as archive:
+            contents = {}
+            async for item in archive:
+                if not item.is_dir:
+                    contents[item.path] = await item.read()
+            for path, md in COMPLEX_MD.items():
+                if not md.isdir:
+                    assert contents[path].decode('utf-8') == md.contents
+
+            item = await archive.get(J('complex', 'goodbye.txt'))
+            chunks = [chunk async for chunk in item.iter_chunks(queue_size=1)]
+            assert b''.join(chunks) == b'Goodbye!'
+
+            # leaving the iterator early releases the archive for the next call
+            async for chunk in item.iter_chunks():
+                break
+            assert await item.read() == b'Goodbye!'
+
+    asyncio.run(main())
+
+def test_test_mode():
+    with Archive('tests/complex.7z') as archive:
+        results = archive.test()
+        assert {result.path for result in results} >= set(COMPLEX_MD)
+        for result in results:
+            assert result.result == OperationResult.kOK
+            md = COMPLEX_MD.get(result.path)
+            if md is not None and not md.isdir:
+                assert result.crc == md.crc
+
+    with Archive('tests/simple_crypt.7z', password='notthepass') as archive:
+        assert [result.result for result in archive.test()] != [OperationResult.kOK]
+
+def test_test_many(tmp_dir):
+    broken = os.path.join(tmp_dir, 'broken.7z')
+    with open('tests/simple.7z', 'rb') as f:
+        data = bytearray(f.read())
+    data[40] ^= 0xFF
+    with open(broken, 'wb') as f:
+        f.write(data)
+
+    reports = test_many(['tests/complex.7z', 'tests/simple.zip', broken, 'tests/nonexistent.7z'], workers=2)
+    assert [report.ok for report in reports] == [True, True, False, False]
+    assert reports[1].results[0].path == 'hello.txt'
+    assert reports[3].error is not None
+
+def test_extract_hashes(tmp_dir):
+    import hashlib
+
+    with Archive('tests/complex.7z') as archive:
+        digests = archive.extract(J(tmp_dir, 'hashes'), hashes=['sha256', 'md5'])
+        for index, item_digests in digests.items():
+            path = J(tmp_dir, 'hashes', archive[index].path)
+            with open(path, 'rb') as f:
+                data = f.read()
+            assert item_digests == {'sha256': hashlib.sha256(data).hexdigest(), 'md5': hashlib.md5(data).hexdigest()}
+        files = {item.index for item in archive if not item.is_dir}
+        assert set(digests) == files
+
+        item = archive[J('complex', 'hello.txt')]
+        expected = {'sha1': hashlib.sha1(b'Hello!').hexdigest()}
+        assert item.extract(io.BytesIO(), hashes=['sha1']) == expected
+        assert archive.extract(J(tmp_dir, 'hashes2'), workers=2, hashes=['sha1'])[item.index] == expected
+
+def test_extract_selected(tmp_dir):
+    def extracted(directory):
+        return sorted(os.path.relpath(J(root, name), directory)
+                      for root, dirs, files in os.walk(directory) for name in files)
+
+    with Archive('tests/complex.7z') as archive:
+        out = J(tmp_dir, 'selected-glob')
+        archive.extract(out, include='complex/**/*.txt', exclude=['complex/articles/**', 'complex/e*'])
+        assert extracted(out) == [J('complex', 'goodbye.txt'), J('complex', 'hello.txt'), J('complex', 'unicode.txt')]
+
+        # hello.txt shares a solid block with goodbye.txt, only hello.txt is written
+        out = J(tmp_dir, 'selected-predicate')
+        archive.extract(out, predicate=lambda item: item.path.endswith('hello.txt'))
+        assert extracted(out) == [J('complex', 'hello.txt')]
+
+        out = J(tmp_dir, 'selected-indices')
+        index = archive[J('complex', 'goodbye.txt')].index
+        digests = archive.extract(out, indices={index}, workers=2, hashes=['md5'])
+        assert extracted(out) == [J('complex', 'goodbye.txt')]
+        assert list(digests) == [index]
+
+        assert archive.select(include=[], predicate=lambda item: False) == []
+
+def test_extraction_plan(tmp_dir):
+    from lib7zip.plan import ExtractionPlan, safe_relpath
+
+    assert safe_relpath('/../a/./b/../c') == J('a', 'b', 'c')
+
+    out = J(tmp_dir, 'plan')
+    with Archive('tests/complex.7z') as archive:
+        plan = ExtractionPlan(archive, out)
+        assert plan.indices == list(range(len(archive)))
+        assert J(out, 'complex', 'articles') in plan.tree
+        archive.extract(out)
+        item = archive[J('complex', 'hello.txt')]
+        assert abs(os.stat(J(out, item.path)).st_mtime - item.mtime.timestamp()) < 1e-5
+
+    with Archive('tests/simple.7z') as archive:
+        archive.extract(out)
+        # p7zip stores the unix mode in the high bits of attrib
+        assert os.stat(J(out, 'hello.txt')).st_mode & 0o777 == (archive[0].attrib >> 16) & 0o777
+
+def test_extract_write_behind(tmp_dir):
+    from lib7zip.writebehind import WriteBehind
+
+    def contents(directory):
+        files = {}
+        for root, dirs, names in os.walk(directory):
+            for name in names:
+                with open(J(root, name), 'rb') as f:
+                    files[os.path.relpath(J(root, name), directory)] = f.read()
+        return files
+
+    with Archive('tests/complex.7z') as archive:
+        archive.extract(J(tmp_dir, 'wb-sync'))
+        digests = archive.extract(J(tmp_dir, 'wb-default'), write_behind=True, hashes=['md5'])
+        assert len(digests) == 6
+        # a byte budget smaller than any chunk still lets every chunk through
+        with WriteBehind(workers=2, max_bytes=1) as writer:
+            archive.extract(J(tmp_dir, 'wb-shared'), write_behind=writer)
+            archive.extract(J(tmp_dir, 'wb-shared2'), write_behind=writer)
+
+        expected = contents(J(tmp_dir, 'wb-sync'))
+        assert len(expected) == 6
+        for name in ('wb-default', 'wb-shared', 'wb-shared2'):
+            assert contents(J(tmp_dir, name)) == expected
+        item = archive[J('complex', 'hello.txt')]
+        assert abs(os.stat(J(tmp_dir, 'wb-default', item.path)).st_mtime - item.mtime.timestamp()) < 1e-5
+
+    # a directory is in the way of the file, opening it fails on a writer thread
+    os.makedirs(J(tmp_dir, 'wb-error', 'hello.txt'))
+    with Archive('tests/simple.7z') as archive:
+        with pytest.raises(IsADirectoryError):
+            archive.extract(J(tmp_dir, 'wb-error'), write_behind=2)
+
+    # errors belong to the extraction that hit them, a shared writer goes on with the next one
+    with WriteBehind(workers=2) as writer, Archive('tests/simple.7z') as archive:
+        with pytest.raises(IsADirectoryError):
+            archive.extract(J(tmp_dir, 'wb-error'), write_behind=writer)
+        assert archive.extract(J(tmp_dir, 'wb-after-error'), write_behind=writer)
+        with open(J(tmp_dir, 'wb-after-error', 'hello.txt'), 'rb') as f:
+            assert f.read() == b'Hello World!\n'
+
+        # nor does draining one group wait for another's writes
+        import threading
+        release = threading.Event()
+        slow, other = writer.group(), writer.group()
+        writer.submit(0, release.wait, group=slow)
+        writer.submit(1, lambda: None, group=other)
+        writer.drain(other)
+        assert slow.pending == 1
+        release.set()
+        writer.drain(slow)
+
+def test_split_volumes(tmp_dir):
+    from lib7zip.volumes import split_volumes
+
+    with open('tests/complex.7z', 'rb') as f:
+        data = f.read()
+    base = J(tmp_dir, 'split.7z')
+    part_size = len(data) // 3 + 1
+    for number in range(3):
+        with open('{}.{:03d}'.format(base, number + 1), 'wb') as f:
+            f.write(data[number * part_size:(number + 1) * part_size])
+
+    assert split_volumes(base + '.001') == ['{}.{:03d}'.format(base, n) for n in (1, 2, 3)]
+    assert split_volumes(base + '.002') is None
+    with Archive(base + '.001', max_open_volumes=1) as archive:
+        assert archive.type_name == '7z'
+        for item in archive:
+            md = COMPLEX_MD.get(item.path)
+            if md is not None and not md.isdir:
+                assert item.contents.decode('utf-8') == md.contents
+        assert archive.volume_pool.open_count == 1
+        archive.extract(J(tmp_dir, 'split'), workers=2)
+        with open(J(tmp_dir, 'split', 'complex', 'hello.txt'), 'rb') as f:
+            assert f.read() == b'Hello!'
+
+def write_spanned_zip(base, members):
+    """
+    members ({name: bytes}) as a spanned zip like zip -s writes it:
+    one member per volume base.z01, base.z02..., the central directory in base.zip
+    """
+    import struct
+    import zipfile
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+        infos = zf.infolist()
+    data = buf.getvalue()
+    eocd = data.rindex(b'PK\x05\x06')
+    cd_size, cd_offset = struct.unpack_from('<II', data, eocd + 12)
+    starts = [info.header_offset for info in infos] + [cd_offset]
+    # the first volume starts with the split marker
+    volumes = [b'PK\x07\x08' + data[starts[0]:starts[1]]] + [data[a:b] for a, b in zip(starts[1:-1], starts[2:])]
+
+    # central directory entries point at their disk and an offset within it
+    cd = bytearray(data[cd_offset:cd_offset + cd_size])
+    pos = 0
+    for disk in range(len(infos)):
+        struct.pack_into('<H', cd, pos + 34, disk)
+        struct.pack_into('<I', cd, pos + 42, 4 if disk == 0 else 0)
+        pos += 46 + sum(struct.unpack_from('<HHH', cd, pos + 28))
+    end = bytearray(data[eocd:])
+    struct.pack_into('<HHHHII', end, 4, len(volumes), len(volumes), len(infos), len(infos), cd_size, 0)
+
+    for number, volume in enumerate(volumes, 1):
+        with open('{}.z{:02d}'.format(base, number), 'wb') as f:
+            f.write(volume)
+    with open(base + '.zip', 'wb') as f:
+        f.write(cd + end)
+
+def test_multi_volume_zip(tmp_dir):
+    from lib7zip.archive import ArchiveOpenError
+
+    members = {'a.txt': b'first volume\n' * 100, 'b.txt': b'second volume\n' * 100}
+    base = J(tmp_dir, 'spanned')
+    write_spanned_zip(base, members)
+
+    # 7-Zip asks the open callback for the other volumes by name
+    with Archive(base + '.zip') as archive:
+        assert archive.type_name == 'zip'
+        assert sorted(archive.open_cb.volumes) == [base + '.z01', base + '.z02']
+        assert {item.path: item.contents for item in archive} == members
+        archive.extract(J(tmp_dir, 'spanned_out'))
+    for name, contents in members.items():
+        with open(J(tmp_dir, 'spanned_out', name), 'rb') as f:
+            assert f.read() == contents
+
+    # GetStream reports the missing volume, the handler gives up
+    os.remove(base + '.z02')
+    with pytest.raises(ArchiveOpenError):
+        Archive(base + '.zip')
+
+def test_open_encrypted_headers():
+    with Archive('tests/simple_crypt_filename.7z', password='password') as archive:
+        assert archive[0].path == 'hello.txt'
+        assert archive[0].contents == b'Hello World!\n'
+
+def test_nested_archives(tmp_dir):
+    import tarfile
+    import zipfile
+
+    inner = J(tmp_dir, 'inner.zip')
+    with zipfile.ZipFile(inner, 'w') as zf:
+        # stored members can be read in place, deflated ones are decoded first
+        zf.write('tests/complex.7z', 'stored/complex.7z', compress_type=zipfile.ZIP_STORED)
+        zf.write('tests/simple.7z', 'deflated/simple.7z', compress_type=zipfile.ZIP_DEFLATED)
+        zf.writestr('notes.zip', b'not really a zip')
+    outer = J(tmp_dir, 'outer.tar')
+    with tarfile.open(outer, 'w') as tf:
+        tf.add(inner, 'inner.zip')
+
+    with Archive(outer) as archive:
+        with archive['inner.zip'].open_archive() as zip_archive:
+            with zip_archive['stored/complex.7z'].open_archive() as complex_archive:
+                assert complex_archive[J('complex', 'hello.txt')].contents == b'Hello!'
+            with zip_archive['deflated/simple.7z'].open_archive() as simple_archive:
+                assert simple_archive[0].contents == b'Hello World!\n'
+
+        contents = {path: item.contents for path, item in archive.walk() if not item.is_dir}
+        assert contents[('inner.zip', 'stored/complex.7z', J('complex', 'goodbye.txt'))] == b'Goodbye!'
+        assert contents[('inner.zip', 'deflated/simple.7z', 'hello.txt')] == b'Hello World!\n'
+        assert contents[('inner.zip', 'notes.zip')] == b'not really a zip'
+        assert [path for path, item in archive.walk(max_depth=1)] == [
+            ('inner.zip',), ('inner.zip', 'stored/complex.7z'), ('inner.zip', 'deflated/simple.7z'),
+            ('inner.zip', 'notes.zip')]
+
+
+def test_archive_pool(tmp_dir, monkeypatch):
+    import time
+
+    paths = [J(tmp_dir, name) for name in ('a.7z', 'b.7z', 'c.7z')]
+    for path in paths:
+        shutil.copy('tests/simple.7z', path)
+
+    with ArchivePool(max_archives=2) as pool:
+        with pool.open(paths[0]) as archive:
+            assert archive[0].contents == b'Hello World!\n'
+            with pool.open(paths[0]) as other:
+                # in use archives aren't shared
+                assert other is not archive
+        with pool.open(paths[0]) as again:
+            assert again in (archive, other)
+        assert (pool.hits, pool.misses) == (1, 2)
+        assert len(pool) == 2
+        assert list(pool.metadata(paths[0])['path']) == ['hello.txt']
+
+        # beyond max_archives the least recently used go
+        for path in paths[1:]:
+            with pool.open(path):
+                pass
+        assert len(pool) == 2
+
+        # a modified file is opened again
+        with pool.open(paths[2]) as archive:
+            pass
+        shutil.copy('tests/complex.7z', paths[2])
+        os.utime(paths[2], ns=(time.time_ns() + 10**9,) * 2)
+        with pool.open(paths[2]) as changed:
+            assert changed is not archive
+            assert changed[J('complex', 'hello.txt')].contents == b'Hello!'
+        assert archive.archive is None
+
+    with pytest.raises(ValueError):
+        pool.checkout(paths[0])
+
+    with ArchivePool(max_bytes=1) as pool:
+        with pool.open(paths[0]):
+            assert len(pool) == 1
+        assert len(pool) == 0
+
+    # opening reads the archive's metadata once, the path index is built from it
+    reads = []
+    metadata = Archive.metadata
+    monkeypatch.setattr(Archive, 'metadata', lambda self, *args: reads.append(args) or metadata(self, *args))
+    with ArchivePool() as pool:
+        with pool.open(paths[0]) as archive:
+            assert archive['hello.txt'].index == 0
+    assert len(reads) == 1
+
+
+def test_extract_archives(tmp_dir):
+    jobs = [(path, J(tmp_dir, str(n))) for n, path in enumerate(['tests/simple.7z', 'tests/complex.7z'] * 4)]
+    jobs.append(ExtractJob('tests/missing.7z', J(tmp_dir, 'missing')))
+    reports = extract_archives(jobs, workers=4)
+    assert [report.path for report in reports] == [job[0] for job in jobs]
+    assert all(report.ok for report in reports[:-1])
+    assert not reports[-1].ok and reports[-1].result is None
+    for n in range(0, 8, 2):
+        with open(J(tmp_dir, str(n), 'hello.txt'), 'rb') as f:
+            assert f.read() == b'Hello World!\n'
+        with open(J(tmp_dir, str(n + 1), 'complex', 'goodbye.txt'), 'rb') as f:
+            assert f.read() == b'Goodbye!'
+
+    # with a shared writer, a job failing to write doesn't fail the others
+    from lib7zip.writebehind import WriteBehind
+    os.makedirs(J(tmp_dir, 'shared-bad', 'hello.txt'))
+    jobs = [(path, J(tmp_dir, 'shared-' + name)) for name, path in
+            [('0', 'tests/simple.7z'), ('bad', 'tests/simple.7z'), ('1', 'tests/complex.7z'), ('2', 'tests/simple.7z')]]
+    with WriteBehind(workers=2) as writer:
+        reports = extract_archives(jobs, workers=2, write_behind=writer)
+    assert [report.ok for report in reports] == [True, False, True, True]
+    assert isinstance(reports[1].error, IsADirectoryError)
+    with open(J(tmp_dir, 'shared-2', 'hello.txt'), 'rb') as f:
+        assert f.read() == b'Hello World!\n'
+
+
+def test_shared_archive_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    with Archive('tests/complex.7z') as archive:
+        def read(path):
+            stream = io.BytesIO()
+            archive[path].extract(stream)
+            return stream.getvalue()
+
+        paths = [J('complex', 'hello.txt'), J('complex', 'goodbye.txt')] * 16
+        with ThreadPoolExecutor(8) as executor:
+            contents = list(executor.map(read, paths))
+        assert contents == [b'Hello!', b'Goodbye!'] * 16
+
+
+def test_format_detection(tmp_dir):
+    from pathlib import PurePath
+    import tarfile
+    import zipfile
+    import lib7zip
+    from lib7zip.archive import ArchiveOpenError
+    from lib7zip.signatures import split_multi_signature
+
+    assert split_multi_signature(b'\x04PK\x03\x04\x02PK\x00') == (b'PK\x03\x04', b'PK')
+    assert lib7zip.load_tables().formats['tar'].signature_offset == 257
+
+    # no extension to go by
+    with zipfile.ZipFile(J(tmp_dir, 'zip_blob'), 'w') as zf:
+        zf.writestr('hello.txt', b'Hello World!\n')
+    with tarfile.open(J(tmp_dir, 'tar_blob'), 'w') as tf:
+        tf.add('tests/simple.7z', 'simple.7z')
+    shutil.copy('tests/simple.7z', J(tmp_dir, '7z_blob'))
+    for type_name in ('zip', 'tar', '7z'):
+        with Archive(J(tmp_dir, type_name + '_blob')) as archive:
+            assert archive.type_name == type_name
+            assert len(archive) == 1
+
+    # the extension lies, the next candidate is tried
+    shutil.copy('tests/simple.7z', J(tmp_dir, 'simple.zip'))
+    with open(J(tmp_dir, 'simple.zip'), 'rb') as f:
+        assert [name for name, _ in Archive.rank_formats(PurePath('simple.zip'), f)][:2] == ['zip', '7z']
+    with Archive(J(tmp_dir, 'simple.zip')) as archive:
+        assert archive.type_name == '7z'
+        assert archive[0].contents == b'Hello World!\n'
+
+    # UDF before ISO, whatever signature or extension order says
+    for head in (bytes(1 << 16), bytes(32768) + b'\x01CD001' + bytes(1 << 10)):
+        names = [name for name, _ in Archive.rank_formats(PurePath('image.iso'), io.BytesIO(head))]
+        assert names.index('Udf') < names.index('Iso')
+
+    # after a stub, found unless told not to look past the start
+    with open(J(tmp_dir, 'stub.7z'), 'wb') as f, open('tests/simple.7z', 'rb') as src:
+        f.write(b'\0' * 1000 + src.read())
+    with Archive(J(tmp_dir, 'stub.7z')) as archive:
+        assert archive[0].contents == b'Hello World!\n'
+    with pytest.raises(ArchiveOpenError):
+        Archive(J(tmp_dir, 'stub.7z'), max_check_start_position=0)
+
+
+def test_signature_offset_types():
+    import lib7zip
+    from lib7zip.wintypes import VARTYPE
+
+    def get_fn(vt, **values):
+        def get(index, propid, pvar):
+            pvar.vt = vt
+            for name, value in values.items():
+                setattr(pvar, name, value)
+            return 0
+        return get
+
+    assert lib7zip.get_offset_prop(0, 8, get_fn(VARTYPE.VT_UI4, ulVal=257)) == 257
+    assert lib7zip.get_offset_prop(0, 8, get_fn(VARTYPE.VT_EMPTY)) == 0
+    # id 8 was kAssociate in older 7-Zip builds
+    assert lib7zip.get_offset_prop(0, 8, get_fn(VARTYPE.VT_BOOL, iVal=-1)) == 0
+
+
+def test_property_descriptors():
+    from concurrent.futures import ThreadPoolExecutor
+    from datetime import datetime
+    from lib7zip.archive import ArchiveItem, ItemProperty
+
+    assert isinstance(ArchiveItem.path, ItemProperty)
+    with Archive('tests/complex.7z') as archive:
+        item = archive[J('complex', 'hello.txt')]
+        assert (item.path, item.size, item.is_dir) == (J('complex', 'hello.txt'), 6, False)
+        assert isinstance(item.mtime, datetime)
+        assert item.comment is None
+        assert archive.solid in (True, False)
+        with pytest.raises(AttributeError):
+            item.not_a_property
+
+        # every thread reads through a PROPVARIANT of its own
+        expected = [item.path for item in archive]
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(lambda _: [item.path for item in archive], range(16)))
+        assert results == [expected] * 16
+
+
+def test_member_cache():
+    from lib7zip.cache import MemberCache
+
+    cache = MemberCache(max_bytes=100, max_sibling_size=10)
+    assert cache.put(1, b'x' * 20)
+    assert not cache.put(2, b'x' * 20, sibling=True)
+    assert not cache.put(3, b'x' * 26)
+    assert cache.put(4, b'y' * 25)
+    assert cache.get(1) == b'x' * 20
+    for index in range(5, 8):
+        cache.put(index, b'z' * 25)
+    # 4 was the least recently used
+    assert 4 not in cache and 1 in cache and cache.size == 95
+
+    with Archive('tests/complex.7z', stats=True) as archive:
+        hello, goodbye = archive[J('complex', 'hello.txt')], archive[J('complex', 'goodbye.txt')]
+        first, second = sorted((hello, goodbye), key=lambda item: item.index)
+        assert first.block == second.block
+        # the first member of the block is decoded on the way to the second
+        assert second.contents in (b'Hello!', b'Goodbye!')
+        assert first.index in archive.cache and archive.cache.captured == 1
+        assert {hello.contents, goodbye.contents} == {b'Hello!', b'Goodbye!'}
+        assert archive.stats()['native']['Extract']['calls'] == 1
+        assert archive.cache.hits == 2
+
+
+def test_open_seekable(tmp_dir):
+    import tarfile
+
+    data = bytes(range(256)) * 64
+    path = J(tmp_dir, 'seekable.tar')
+    with tarfile.open(path, 'w') as tf:
+        info = tarfile.TarInfo('data.bin')
+        info.size = len(data)
+        tf.addfile(info, io.BytesIO(data))
+
+    with Archive(path) as archive:
+        with archive['data.bin'].open(seekable=True) as f:
+            assert f.seekable()
+            assert f.seek(0, io.SEEK_END) == len(data)
+            assert f.seek(1000) == 1000
+            assert f.read(10) == data[1000:1010]
+            assert f.tell() == 1010
+            f.seek(-6, io.SEEK_END)
+            assert f.read() == data[-6:]
+        assert f.closed
+        # the references taken for the reader were all released, the member can be opened again
+        with archive['data.bin'].open(seekable=True) as f:
+            assert f.read() == data
+
+    # solid 7z members can only be decoded in order
+    with Archive('tests/complex.7z') as archive:
+        with archive[J('complex', 'hello.txt')].open(seekable=True) as f:
+            assert not f.seekable()
+            assert f.read() == b'Hello!'
+
+
+def test_extract_into():
+    import mmap
+
+    with Archive('tests/complex.7z') as archive:
+        item = archive[J('complex', 'hello.txt')]
+        buf = bytearray(b'.' * 10)
+        assert item.extract_into(buf, offset=2) == 6
+        assert buf == b'..Hello!..'
+
+        shared = mmap.mmap(-1, item.size)
+        assert item.extract_into(shared) == item.size
+        assert shared[:] == b'Hello!'
+        shared.close()
+
+        with pytest.raises(ValueError):
+            item.extract_into(bytearray(5))
+        with pytest.raises(TypeError):
+            item.extract_into(b'read-only buffer')
+        # a bytearray can grow again afterwards, the buffer was released
+        buf.extend(b'!')